@@ -220,6 +220,9 @@ def _format_candle_lines(candles_newest_first: list[dict], n: int = 8) -> str:
     return '\n'.join(lines)
 
 
+_ROMA_BUSY_RETRIES = 5
+
+
 def _call_roma_for_window(
     ticker: str,
     entry_dt: datetime,
@@ -270,19 +273,26 @@ def _call_roma_for_window(
     )
 
     try:
-        resp = _SESSION.post(
-            "http://localhost:8001/analyze",
-            json={
-                "goal":           goal,
-                "context":        context,
-                "max_depth":      1,
-                "roma_mode":      roma_mode,
-                "provider":       provider,
-                "api_keys":       api_keys or {},
-                "model_override": model_override,
-            },
-            timeout=55,
-        )
+        for attempt in range(_ROMA_BUSY_RETRIES + 1):
+            resp = _SESSION.post(
+                "http://localhost:8001/analyze",
+                json={
+                    "goal":           goal,
+                    "context":        context,
+                    "max_depth":      1,
+                    "roma_mode":      roma_mode,
+                    "provider":       provider,
+                    "api_keys":       api_keys or {},
+                    "model_override": model_override,
+                },
+                timeout=55,
+            )
+            # 429 = service at its in-flight limit (shared with live /analyze traffic) — wait, don't drop
+            if resp.status_code != 429 or attempt == _ROMA_BUSY_RETRIES:
+                break
+            delay = float(resp.headers.get("Retry-After") or 2)
+            logger.info(f"[BACKTEST] ROMA busy for {ticker} — retry {attempt + 1} in {delay:.0f}s")
+            time.sleep(delay)
         resp.raise_for_status()
         answer = resp.json().get("answer", "")
 
@@ -0,0 +1,243 @@
+"""
+LLM Response Cache
+──────────────────
+Exact-match cache for /analyze responses. Identical (model, prompt, depth)
+inputs skip the full multi-agent ROMA solve and return the stored
+AnalyzeResponse payload.
+
+Backends (CACHE_BACKEND env):
+  memory (default) — in-process LRU, CACHE_MAX_ENTRIES entries (default 1024)
+  redis            — redis.asyncio at REDIS_URL, shared across workers
+
+SemanticCache (ENABLE_SEMANTIC_CACHE=1) additionally matches near-duplicate
+prompts by embedding cosine similarity — lossy, so it is off by default.
+"""
+
+import os
+import time
+import atexit
+import asyncio
+import hashlib
+import logging
+import threading
+import json as _json
+from typing import Optional
+
+from cachetools import LRUCache
+
+logger = logging.getLogger("roma.llm_cache")
+
+try:
+    from prometheus_client import Counter
+    _HITS   = Counter("llm_cache_hits_total",   "Exact-match /analyze cache hits")
+    _MISSES = Counter("llm_cache_misses_total", "Exact-match /analyze cache misses")
+except ImportError:
+    _HITS = _MISSES = None
+
+DEFAULT_TTL = int(os.getenv("CACHE_TTL_SECONDS", "300"))
+# When > 0, every /analyze response is cached this many seconds, not just deterministic ones
+RESPONSE_TTL = int(os.getenv("ROMA_CACHE_TTL", "0"))
+
+
+try:
+    import xxhash
+    _digest = lambda data: xxhash.xxh3_128_hexdigest(data)  # noqa: E731 — ~10× sha256 on long prompts
+except ImportError:
+    _digest = lambda data: hashlib.sha256(data).hexdigest()  # noqa: E731
+
+
+def make_cache_key(**parts) -> str:
+    """Fast 128-bit digest of the sorted JSON encoding of the key parts — never include API keys."""
+    return _digest(_json.dumps(parts, sort_keys=True).encode())
+
+
+class LLMCache:
+    """Async get/set cache; values are JSON-serialisable dicts."""
+
+    def __init__(self, backend: str = "memory", maxsize: int = 1024, redis_url: Optional[str] = None):
+        self.backend = backend
+        self._lru: LRUCache = LRUCache(maxsize=maxsize)
+        self._lock = asyncio.Lock()
+        self._redis = None
+        if backend == "redis":
+            import redis.asyncio as aioredis
+            self._redis = aioredis.from_url(redis_url or "redis://localhost:6379/0")
+
+    @classmethod
+    def from_env(cls) -> "LLMCache":
+        backend = os.getenv("CACHE_BACKEND", "memory").lower()
+        try:
+            return cls(
+                backend=backend,
+                maxsize=int(os.getenv("CACHE_MAX_ENTRIES", "1024")),
+                redis_url=os.getenv("REDIS_URL"),
+            )
+        except ImportError:
+            logger.warning("CACHE_BACKEND=%s unavailable (pip install redis) — using in-process LRU", backend)
+            return cls(backend="memory", maxsize=int(os.getenv("CACHE_MAX_ENTRIES", "1024")))
+
+    async def get(self, key: str) -> Optional[dict]:
+        value: Optional[dict] = None
+        if self._redis is not None:
+            raw = await self._redis.get(f"llm:{key}")
+            value = _json.loads(raw) if raw else None
+        else:
+            async with self._lock:
+                entry = self._lru.get(key)
+                if entry is not None:
+                    expires_at, stored = entry
+                    if expires_at > time.monotonic():
+                        value = stored
+                    else:
+                        del self._lru[key]
+
+        counter = _HITS if value is not None else _MISSES
+        if counter is not None:
+            counter.inc()
+        return value
+
+    async def set(self, key: str, value: dict, ttl: int = DEFAULT_TTL) -> None:
+        if self._redis is not None:
+            await self._redis.set(f"llm:{key}", _json.dumps(value), ex=ttl)
+            return
+        async with self._lock:
+            self._lru[key] = (time.monotonic() + ttl, value)
+
+
+class SemanticCache:
+    """
+    Nearest-neighbour cache over prompt embeddings (fastembed MiniLM + hnswlib).
+    A stored response is returned when cosine similarity >= threshold and the
+    scope (model / providers / mode) matches exactly. Methods are blocking —
+    call them from a worker thread.
+
+    Holds at most max_elements entries as a ring buffer (the oldest is overwritten).
+    Vectors and entries are snapshotted to one .npz file at most every save_interval
+    seconds and at exit, written to a temp file and renamed so a crash can't tear it;
+    the hnswlib index is rebuilt from the vectors on load.
+    """
+
+    MODEL = "sentence-transformers/all-MiniLM-L6-v2"
+    DIM   = 384
+
+    def __init__(self, path: str, threshold: float = 0.92, max_elements: int = 10_000, save_interval: float = 60.0):
+        import numpy as np
+        from fastembed import TextEmbedding
+
+        self.path          = path
+        self.threshold     = threshold
+        self.max_elements  = max_elements
+        self.save_interval = save_interval
+        self._embedder     = TextEmbedding(self.MODEL)
+        self._index        = self._new_index()
+        self._vectors      = np.zeros((max_elements, self.DIM), dtype=np.float32)
+        self._entries: dict[int, tuple[str, dict]] = {}
+        self._next         = 0          # total adds; label = _next % max_elements
+        self._dirty        = False
+        self._saved_at     = time.monotonic()
+        self._lock         = threading.Lock()
+        self._save_lock    = threading.Lock()
+
+        if os.path.exists(path):
+            try:
+                self._load()
+            except Exception as e:  # corrupt / foreign file — start empty rather than fail boot
+                logger.warning("semantic cache %s unreadable (%s) — starting empty", path, e)
+                self._index, self._entries, self._next = self._new_index(), {}, 0
+
+    @classmethod
+    def from_env(cls) -> Optional["SemanticCache"]:
+        if os.getenv("ENABLE_SEMANTIC_CACHE", "0") != "1":
+            return None
+        try:
+            cache = cls(
+                path=os.getenv("SEMANTIC_CACHE_PATH", "semantic_cache.npz"),
+                threshold=float(os.getenv("SEMANTIC_SIM_THRESHOLD", "0.92")),
+                max_elements=int(os.getenv("SEMANTIC_CACHE_MAX_ENTRIES", "10000")),
+                save_interval=float(os.getenv("SEMANTIC_CACHE_SAVE_S", "60")),
+            )
+        except ImportError:
+            logger.warning("ENABLE_SEMANTIC_CACHE=1 but fastembed/hnswlib missing — semantic cache disabled")
+            return None
+        atexit.register(cache.save)
+        return cache
+
+    def _new_index(self):
+        import hnswlib
+
+        index = hnswlib.Index(space="cosine", dim=self.DIM)
+        index.init_index(max_elements=self.max_elements, ef_construction=200, M=16)
+        index.set_ef(50)
+        return index
+
+    def _load(self) -> None:
+        import numpy as np
+
+        with np.load(self.path, allow_pickle=False) as data:
+            vectors = data["vectors"]
+            entries = _json.loads(str(data["entries"]))
+            next_id = int(data["next"])
+        count = min(len(vectors), len(entries), self.max_elements)
+        if count:
+            self._vectors[:count] = vectors[:count]
+            self._index.add_items(self._vectors[:count], np.arange(count))
+        self._entries = {i: (entries[i][0], entries[i][1]) for i in range(count)}
+        # Keep the ring position only when the ring is exactly as full as it was written.
+        # A smaller SEMANTIC_CACHE_MAX_ENTRIES restarts it; a larger one continues after the
+        # loaded labels — next_id would point past them and save() would miss labels.
+        self._next = next_id if len(entries) == self.max_elements else count
+
+    def embed(self, text: str):
+        return next(iter(self._embedder.embed([text])))
+
+    def lookup(self, vec, scope: str) -> Optional[dict]:
+        with self._lock:
+            count = self._index.get_current_count()
+            if count == 0:
+                return None
+            ids, dists = self._index.knn_query(vec, k=min(5, count))
+            for item_id, dist in zip(ids[0], dists[0]):
+                if 1.0 - float(dist) < self.threshold:
+                    break  # results are sorted nearest-first
+                entry = self._entries.get(int(item_id))
+                if entry is not None and entry[0] == scope:
+                    return entry[1]
+        return None
+
+    def add(self, vec, scope: str, value: dict) -> None:
+        with self._lock:
+            label = self._next % self.max_elements
+            self._index.add_items([vec], [label])  # an existing label is replaced in place
+            self._vectors[label] = vec
+            self._entries[label] = (scope, value)
+            self._next += 1
+            self._dirty = True
+            due = time.monotonic() - self._saved_at >= self.save_interval
+        if due:
+            self.save()
+
+    def save(self) -> None:
+        """Snapshot to disk if anything changed; the write happens outside the lookup lock."""
+        import numpy as np
+
+        if not self._save_lock.acquire(blocking=False):
+            return  # another thread is already saving
+        try:
+            with self._lock:
+                if not self._dirty:
+                    return
+                count = min(self._next, self.max_elements)
+                vectors = self._vectors[:count].copy()
+                entries = [self._entries[i] for i in range(count)]
+                next_id = self._next
+                self._dirty, self._saved_at = False, time.monotonic()
+            tmp = f"{self.path}.tmp"
+            with open(tmp, "wb") as f:  # file object — np.savez would append .npz to a name
+                np.savez(f, vectors=vectors, entries=np.array(_json.dumps(entries)), next=np.array(next_id))
+            os.replace(tmp, self.path)
+        except Exception as e:
+            logger.warning("semantic cache save failed (%s)", e)
+            with self._lock:
+                self._dirty = True
+        finally:
+            self._save_lock.release()
@@ -10,36 +10,138 @@ Runs the actual Sentient Foundation ROMA recursive solve loop:
 Usage:
   pip install -r requirements.txt
   cp .env.example .env
-  uvicorn main:app --port 8001 --host 0.0.0.0
+  uvicorn main:app --port 8001 --host 0.0.0.0 --workers 1 --loop uvloop --http httptools
+
+/analyze is async: each solve() runs on a worker thread, so one process
+overlaps many concurrent ROMA solves while they wait on LLM sockets.
 """
 
 import os
 import re
-import copy
+import sys
 import time
+import asyncio
+import copy
+import hashlib
+import atexit
+import dataclasses
+import functools
+import itertools
+import threading
+import contextvars
+import logging
 import traceback
 import json as _json
+from concurrent.futures import ThreadPoolExecutor
 from datetime import datetime, timezone
-from typing import Optional
-from concurrent.futures import ThreadPoolExecutor, as_completed
-
+from logging.handlers import QueueHandler, QueueListener
+from operator import attrgetter
+from queue import SimpleQueue
+from types import MappingProxyType
+from typing import Callable, Mapping, Optional
+from dataclasses import dataclass, field
+from enum import StrEnum
+
+import anyio
 import dspy
+import orjson
+import msgspec
+import httpx
+import litellm
 from fastapi import FastAPI, HTTPException, Request
 from fastapi.middleware.cors import CORSMiddleware
+from fastapi.responses import ORJSONResponse, Response, StreamingResponse
+from dspy.utils.callback import BaseCallback
 from pydantic import BaseModel
+from cachetools import LRUCache
 from roma_dspy.core.engine.solve import solve, ROMAConfig
 from roma_dspy.resilience.circuit_breaker import module_circuit_breaker
 from roma_dspy.config.schemas.base import RuntimeConfig, LLMConfig
 from roma_dspy.types.adapter_type import AdapterType
 from roma_dspy.config.schemas.agents import AgentConfig, AgentsConfig
-from dotenv import load_dotenv
+from dotenv import dotenv_values, load_dotenv
+
+try:
+    import xxhash
+    _chunk_digest = xxhash.xxh3_64_intdigest
+except ImportError:  # xxhash is a speed-up only — blake2b gives the same dedup result
+    def _chunk_digest(chunk: str) -> bytes:
+        return hashlib.blake2b(chunk.encode(), digest_size=16).digest()
+
+_REAL_ENV_KEYS = frozenset(os.environ)  # set before .env is applied — these always win, even on /reset-config
+load_dotenv(override=False)  # parsed once; real environment variables win over .env
+
+# after load_dotenv — both read their env knobs (CACHE_TTL_SECONDS, ROMA_CACHE_TTL) at import
+from llm_cache import DEFAULT_TTL, RESPONSE_TTL, LLMCache, SemanticCache, make_cache_key  # noqa: E402
+from providers import LLMPool, retry_transient  # noqa: E402
+
+
+# ── Logging ──────────────────────────────────────────────────────────────────
+
+class _JsonFormatter(logging.Formatter):
+    """One JSON object per line: event name, level, any `extra` fields, traceback if present."""
+
+    _RESERVED = set(vars(logging.makeLogRecord({}))) | {"message", "asctime"}
+
+    def format(self, record: logging.LogRecord) -> str:
+        payload = {"event": record.getMessage(), "level": record.levelname, "logger": record.name}
+        payload.update({k: v for k, v in vars(record).items() if k not in self._RESERVED})
+        if record.exc_info:
+            payload["exc"] = self.formatException(record.exc_info)
+        return orjson.dumps(payload, default=str).decode()
+
+
+class _TracebackRateLimit(logging.Filter):
+    """Keep at most one traceback per (exception type, provider) per window — a provider
+    outage otherwise formats the same stack for every failing request."""
+
+    def __init__(self, window_s: float = 10.0):
+        super().__init__()
+        self.window_s = window_s
+        self._last: dict[tuple, float] = {}
+
+    def filter(self, record: logging.LogRecord) -> bool:
+        if record.exc_info and record.exc_info[0] is not None:
+            key = (record.exc_info[0].__name__, getattr(record, "provider", None))
+            now = time.monotonic()
+            if now - self._last.get(key, 0.0) < self.window_s:
+                record.exc_info = None
+                record.exc_text = None
+                record.suppressed_traceback = True
+            else:
+                self._last[key] = now
+        return True
+
 
-load_dotenv()
+class _DeferredQueueHandler(QueueHandler):
+    """Enqueue the record as-is: formatting (JSON, tracebacks) happens on the listener thread.
+    The stock prepare() formats on the caller and drops exc_info, which is the cost we're avoiding."""
+
+    def prepare(self, record: logging.LogRecord) -> logging.LogRecord:
+        record.msg  = record.getMessage()  # freeze args now — they may be mutated after the call
+        record.args = None
+        return record
+
+
+# Request handlers only enqueue (~1µs); a listener thread owns the stdout write lock
+_log_queue: SimpleQueue = SimpleQueue()
+_log_handler = logging.StreamHandler(sys.stdout)
+_log_handler.setFormatter(_JsonFormatter())
+_log_handler.addFilter(_TracebackRateLimit())
+_log_listener = QueueListener(_log_queue, _log_handler)
+_log_listener.start()
+atexit.register(_log_listener.stop)  # flush queued records on shutdown
+
+log = logging.getLogger("roma")
+log.addHandler(_DeferredQueueHandler(_log_queue))
+log.setLevel(logging.INFO)
+log.propagate = False
 
 app = FastAPI(
     title="Sentient Market Reader — ROMA Service",
     description="Runs the real roma-dspy ROMA solve loop for Kalshi KXBTC15M analysis",
     version="1.0.0",
+    default_response_class=ORJSONResponse,
 )
 
 app.add_middleware(
@@ -49,193 +151,1107 @@ app.add_middleware(
     allow_headers=["*"],
 )
 
+# Prometheus scrape endpoint: response-cache hits/misses (llm_cache), plus the admission
+# control metrics defined here — in-flight solves and 429s.
+try:
+    from prometheus_client import Counter, Gauge, make_asgi_app
+    app.mount("/metrics", make_asgi_app())
+    _inflight_gauge = Gauge("inflight_gauge", "ROMA solves currently running")
+    _rejected_429   = Counter("rejected_429_total", "/analyze requests shed with 429")
+except ImportError:  # metrics are optional — the service runs without prometheus_client
+    _inflight_gauge = _rejected_429 = None
+
 
 # ── LLM configuration ────────────────────────────────────────────────────────
 
-def build_llm_config(
-    provider_override: Optional[str] = None,
-    model_override: Optional[str] = None,
-    api_keys: Optional[dict] = None,
-) -> tuple[LLMConfig, str]:
-    """
-    Build an LLMConfig from environment variables (or user-provided keys).
-    Single model per provider — set via env var or model_override.
-    api_keys: optional dict with per-provider keys e.g. {'openrouter': '...', 'anthropic': '...'}
-    provider_override: if set, takes precedence over AI_PROVIDER env var.
-    """
-    provider = provider_override or os.getenv("AI_PROVIDER", "grok")
-    ak = api_keys or {}
+# Env-var prefix for per-tier model overrides, e.g. GROK_FAST_MODEL / HF_SMART_MODEL
+_TIER_ENV_PREFIX = {
+    "anthropic":   "ANTHROPIC",
+    "openai":      "OPENAI",
+    "grok":        "GROK",
+    "openrouter":  "OPENROUTER",
+    "huggingface": "HF",
+}
 
-    if provider == "anthropic":
-        api_key = ak.get("anthropic") or os.getenv("ANTHROPIC_API_KEY")
-        if not api_key:
-            raise ValueError("ANTHROPIC_API_KEY not set")
-        model = model_override or os.getenv("ANTHROPIC_MODEL", "claude-haiku-4-5-20251001")
-        return (
-            LLMConfig(model=f"anthropic/{model}", api_key=api_key),
-            f"anthropic/{model}",
+# AI_ROUTING tier models when <PREFIX>_<TIER>_MODEL isn't set (the defaults .env.example shows).
+# Providers without an entry fall back to their default model for every tier.
+_TIER_DEFAULTS = {
+    "grok": {"fast": "grok-3-mini", "mid": "grok-3-fast", "smart": "grok-3"},
+    "huggingface": {
+        "fast":  "meta-llama/Llama-3.2-3B-Instruct",
+        "mid":   "meta-llama/Llama-3.1-8B-Instruct",
+        "smart": "meta-llama/Llama-3.3-70B-Instruct",
+    },
+}
+
+
+@dataclass(frozen=True, slots=True)
+class EnvSnapshot:
+    """Env vars used on the request path, read once at import — handlers never touch os.environ."""
+    ai_provider: str
+    ai_provider2: Optional[str]
+    ai_routing: Optional[str]
+    roma_mode: str
+    roma_beam_width: int
+    anthropic_api_key: Optional[str]
+    anthropic_model: str
+    openai_api_key: Optional[str]
+    openai_model: str
+    xai_api_key: Optional[str]
+    grok_model: str
+    openrouter_api_key: Optional[str]
+    openrouter_model: str
+    huggingface_api_key: Optional[str]
+    hf_base_url: str
+    huggingface_model: str
+    google_ai_api_key: Optional[str]           # /optimize — direct Gemini
+    tier_models: Mapping[str, str]             # {"GROK_FAST_MODEL": "grok-3-mini", ...}
+
+    @classmethod
+    def from_environ(cls) -> "EnvSnapshot":
+        tier_vars = (f"{prefix}_{tier}_MODEL" for prefix in _TIER_ENV_PREFIX.values()
+                     for tier in ("FAST", "MID", "SMART"))
+        return cls(
+            ai_provider=os.getenv("AI_PROVIDER", "grok"),
+            ai_provider2=os.getenv("AI_PROVIDER2") or None,
+            ai_routing=os.getenv("AI_ROUTING") or None,
+            roma_mode=os.getenv("ROMA_MODE", "keen"),
+            roma_beam_width=int(os.getenv("ROMA_BEAM_WIDTH", "2")),
+            anthropic_api_key=os.getenv("ANTHROPIC_API_KEY"),
+            anthropic_model=os.getenv("ANTHROPIC_MODEL", "claude-haiku-4-5-20251001"),
+            openai_api_key=os.getenv("OPENAI_API_KEY"),
+            openai_model=os.getenv("OPENAI_MODEL", "gpt-4o-mini"),
+            xai_api_key=os.getenv("XAI_API_KEY"),
+            grok_model=os.getenv("GROK_MODEL", "grok-3-mini-fast"),
+            openrouter_api_key=os.getenv("OPENROUTER_API_KEY"),
+            openrouter_model=os.getenv("OPENROUTER_MODEL", "google/gemini-2.5-flash"),
+            huggingface_api_key=os.getenv("HUGGINGFACE_API_KEY") or os.getenv("HF_API_KEY"),
+            hf_base_url=os.getenv("HF_BASE_URL", "https://router.huggingface.co/v1"),
+            huggingface_model=os.getenv("HUGGINGFACE_MODEL", "Qwen/Qwen2.5-7B-Instruct"),
+            google_ai_api_key=os.getenv("GOOGLE_AI_API_KEY") or os.getenv("GEMINI_API_KEY"),
+            tier_models=MappingProxyType({k: v for k in tier_vars if (v := os.getenv(k))}),
         )
 
+
+_ENV = EnvSnapshot.from_environ()
+
+
+def _tier_model(provider: str, tier: Optional[str]) -> Optional[str]:
+    """Model for a tier (fast | mid | smart): env, then _TIER_DEFAULTS, else None (provider default)."""
+    if not tier or provider not in _TIER_ENV_PREFIX:
+        return None
+    pinned = _ENV.tier_models.get(f"{_TIER_ENV_PREFIX[provider]}_{tier.upper()}_MODEL")
+    return pinned or _TIER_DEFAULTS.get(provider, {}).get(tier.lower())
+
+
+@functools.lru_cache(maxsize=64)
+def _cached_llm_config(provider: str, model: str, api_key: str, base_url: Optional[str]) -> tuple[LLMConfig, str]:
+    """LLMConfig is a pure function of (provider, model, key, base_url) — validate each combo once."""
+    if provider == "anthropic":
+        return LLMConfig(model=f"anthropic/{model}", api_key=api_key), f"anthropic/{model}"
+
     if provider == "openai":
-        api_key = ak.get("openai") or os.getenv("OPENAI_API_KEY")
-        if not api_key:
-            raise ValueError("OPENAI_API_KEY not set")
-        model = model_override or os.getenv("OPENAI_MODEL", "gpt-4o-mini")
-        return (
-            LLMConfig(model=f"openai/{model}", api_key=api_key),
-            f"openai/{model}",
-        )
+        return LLMConfig(model=f"openai/{model}", api_key=api_key), f"openai/{model}"
 
     if provider == "grok":
-        api_key = ak.get("xai") or ak.get("grok") or os.getenv("XAI_API_KEY")
-        if not api_key:
-            raise ValueError("XAI_API_KEY not set")
-        model = model_override or os.getenv("GROK_MODEL", "grok-3-mini-fast")
         return (
-            LLMConfig(
-                model=f"openai/{model}",
-                api_key=api_key,
-                base_url="https://api.x.ai/v1",
-            ),
+            LLMConfig(model=f"openai/{model}", api_key=api_key, base_url=base_url),
             f"grok/{model}",
         )
 
     if provider == "openrouter":
-        api_key = ak.get("openrouter") or os.getenv("OPENROUTER_API_KEY")
-        if not api_key:
-            raise ValueError("OPENROUTER_API_KEY not set")
-        model = model_override or os.getenv("OPENROUTER_MODEL", "google/gemini-2.5-flash")
         return (
             LLMConfig(
                 model=f"openrouter/{model}",
                 api_key=api_key,
-                base_url="https://openrouter.ai/api/v1",
+                base_url=base_url,
                 adapter_type=AdapterType.CHAT,         # force ChatAdapter — JSONAdapter fails on non-grok models via OpenRouter
                 use_native_function_calling=False,      # prevents DSPy from auto-switching to tool-call format
             ),
             f"openrouter/{model}",
         )
 
-    if provider == "huggingface":
-        api_key = ak.get("huggingface") or ak.get("hf") or os.getenv("HUGGINGFACE_API_KEY") or os.getenv("HF_API_KEY")
-        if not api_key:
-            raise ValueError("HUGGINGFACE_API_KEY not set")
-        base_url = os.getenv("HF_BASE_URL", "https://router.huggingface.co/v1")
-        model = model_override or os.getenv("HUGGINGFACE_MODEL", "Qwen/Qwen2.5-7B-Instruct")
-        return (
-            LLMConfig(
-                model=f"openai/{model}",
-                api_key=api_key,
-                base_url=base_url,
-            ),
-            f"huggingface/{model}",
-        )
+    # huggingface — OpenAI-compatible router
+    return (
+        LLMConfig(model=f"openai/{model}", api_key=api_key, base_url=base_url),
+        f"huggingface/{model}",
+    )
+
+
+# Per-provider resolution of api_keys → (api_key, default model, base_url). Request keys win over env.
+
+def _anthropic_llm(ak: dict) -> tuple[str, str, Optional[str]]:
+    api_key = ak.get("anthropic") or _ENV.anthropic_api_key
+    if not api_key:
+        raise ValueError("ANTHROPIC_API_KEY not set")
+    return api_key, _ENV.anthropic_model, None
+
+
+def _openai_llm(ak: dict) -> tuple[str, str, Optional[str]]:
+    api_key = ak.get("openai") or _ENV.openai_api_key
+    if not api_key:
+        raise ValueError("OPENAI_API_KEY not set")
+    return api_key, _ENV.openai_model, None
+
+
+def _grok_llm(ak: dict) -> tuple[str, str, Optional[str]]:
+    api_key = ak.get("xai") or ak.get("grok") or _ENV.xai_api_key
+    if not api_key:
+        raise ValueError("XAI_API_KEY not set")
+    return api_key, _ENV.grok_model, "https://api.x.ai/v1"
+
 
-    raise ValueError(f"Unknown AI_PROVIDER '{provider}' — use: anthropic | openai | grok | openrouter | huggingface")
+def _openrouter_llm(ak: dict) -> tuple[str, str, Optional[str]]:
+    api_key = ak.get("openrouter") or _ENV.openrouter_api_key
+    if not api_key:
+        raise ValueError("OPENROUTER_API_KEY not set")
+    return api_key, _ENV.openrouter_model, "https://openrouter.ai/api/v1"
 
 
-def build_roma_config_tiered(analysis_llm: LLMConfig, orchestration_llm: LLMConfig, roma_mode: str = "keen") -> ROMAConfig:
+def _huggingface_llm(ak: dict) -> tuple[str, str, Optional[str]]:
+    api_key = ak.get("huggingface") or ak.get("hf") or _ENV.huggingface_api_key
+    if not api_key:
+        raise ValueError("HUGGINGFACE_API_KEY not set")
+    return api_key, _ENV.huggingface_model, _ENV.hf_base_url
+
+
+_PROVIDER_HANDLERS: dict[str, Callable[[dict], tuple[str, str, Optional[str]]]] = {
+    "anthropic":   _anthropic_llm,
+    "openai":      _openai_llm,
+    "grok":        _grok_llm,
+    "openrouter":  _openrouter_llm,
+    "huggingface": _huggingface_llm,
+}
+
+
+def _resolve_provider(provider_override: Optional[str], api_keys: Optional[dict]) -> tuple[str, str, str, Optional[str]]:
+    provider = provider_override or _ENV.ai_provider
+    handler = _PROVIDER_HANDLERS.get(provider)
+    if handler is None:
+        raise ValueError(f"Unknown AI_PROVIDER '{provider}' — use: {' | '.join(_PROVIDER_HANDLERS)}")
+    return (provider, *handler(api_keys or {}))
+
+
+def _provider_configured(provider: str, api_keys: Optional[dict] = None) -> bool:
+    """True when a key resolves for provider (request keys or env) — failover skips the rest."""
+    try:
+        _resolve_provider(provider, api_keys)
+    except ValueError:
+        return False
+    return True
+
+
+def build_llm_config(
+    provider_override: Optional[str] = None,
+    model_override: Optional[str] = None,
+    api_keys: Optional[dict] = None,
+    tier: Optional[str] = None,
+) -> tuple[LLMConfig, str]:
     """
-    Tiered ROMA config — fastest quality mix:
-      Atomizer + Planner  → orchestration_llm (fast/cheap — just task decomposition)
-      Executor + Aggregator → analysis_llm (quality model — the actual reasoning)
+    Build an LLMConfig from environment variables (or user-provided keys).
+    Single model per provider — set via env var or model_override.
+    api_keys: optional dict with per-provider keys e.g. {'openrouter': '...', 'anthropic': '...'}
+    provider_override: if set, takes precedence over AI_PROVIDER env var.
+    tier: optional fast | mid | smart — picks <PROVIDER>_<TIER>_MODEL when that env var is set.
+    Returned configs are shared across requests — copy before mutating.
+    """
+    provider, api_key, default_model, base_url = _resolve_provider(provider_override, api_keys)
+    model = model_override or _tier_model(provider, tier) or default_model
+    return _cached_llm_config(provider, model, api_key, base_url)
 
-    Token budgets tuned to stay above content truncation point without excessive
-    generation time. Tiered by mode for wall-time predictability.
+
+def build_llm_configs_pair(
+    provider_override: Optional[str] = None,
+    model_override: Optional[str] = None,
+    api_keys: Optional[dict] = None,
+) -> tuple[tuple[LLMConfig, str], tuple[LLMConfig, str]]:
     """
-    _token_budgets = {
-        "blitz": {"executor": 3000, "aggregator": 1500},
-        "sharp": {"executor": 3500, "aggregator": 1800},
-        "keen":  {"executor": 4000, "aggregator": 2000},
-        "smart": {"executor": 4500, "aggregator": 2500},
-    }
-    budgets = _token_budgets.get(roma_mode, _token_budgets["keen"])
+    (analysis, orchestration) configs from one key/base_url resolution. Analysis honours
+    model_override; orchestration always uses the provider default — the same object
+    when there is no override.
+    """
+    provider, api_key, default_model, base_url = _resolve_provider(provider_override, api_keys)
+    orchestration = _cached_llm_config(provider, default_model, api_key, base_url)
+    if not model_override or model_override == default_model:
+        return orchestration, orchestration
+    return _cached_llm_config(provider, model_override, api_key, base_url), orchestration
+
+
+# ── Anthropic prompt caching ─────────────────────────────────────────────────
+# Every ROMA agent call re-sends the goal + market context. Anthropic caches a marked
+# prefix (>= 1024 tokens) at ~10% of input cost, so split each message at the
+# "Market context:" boundary and mark the static part ephemeral. Applied in the LLM call
+# gate, so it reaches the LMs ROMA builds per agent, with their own sampling settings.
+
+_CONTEXT_MARKER  = "Market context:\n"
+_VOLATILE_MARKER = "(latest):\n"       # context packs: stable chunks precede this, so cache through them
+_ANTHROPIC_CACHE_MIN_TOKENS = 1024
+
+
+def _with_cache_breakpoints(messages: list[dict]) -> list[dict]:
+    """Restructure string message content into [cached static prefix, dynamic tail] blocks."""
+    out: list[dict] = []
+    for msg in messages:
+        content = msg.get("content")
+        if isinstance(content, str):
+            split_at = content.find(_VOLATILE_MARKER)
+            if split_at <= 0:
+                split_at = content.find(_CONTEXT_MARKER)
+            static_prefix = content[:split_at] if split_at > 0 else (content if msg.get("role") == "system" else "")
+            # ~4 chars per token — below the minimum Anthropic ignores the breakpoint anyway
+            if len(static_prefix) // 4 >= _ANTHROPIC_CACHE_MIN_TOKENS:
+                blocks = [{"type": "text", "text": static_prefix, "cache_control": {"type": "ephemeral"}}]
+                if len(static_prefix) < len(content):
+                    blocks.append({"type": "text", "text": content[len(static_prefix):]})
+                msg = {**msg, "content": blocks}
+        out.append(msg)
+    return out
+
+
+def _cache_anthropic_prompt(call_kwargs: dict) -> bool:
+    """Add cache breakpoints to an anthropic/ litellm call's messages in place; True if it is one."""
+    if not str(call_kwargs.get("model", "")).startswith("anthropic/") or not call_kwargs.get("messages"):
+        return False
+    call_kwargs["messages"] = _with_cache_breakpoints(call_kwargs["messages"])
+    return True
+
+
+def _log_cache_usage(response) -> None:
+    usage = getattr(response, "usage", None)
+    if usage is None:
+        return
+    log.info("anthropic_cache", extra={
+        "cache_created": getattr(usage, "cache_creation_input_tokens", 0) or 0,
+        "cache_read": getattr(usage, "cache_read_input_tokens", 0) or 0,
+    })
+
+
+@functools.lru_cache(maxsize=64)
+def shared_lm(
+    model: str,
+    api_key: Optional[str],
+    base_url: Optional[str] = None,
+    temperature: Optional[float] = None,
+    max_tokens: Optional[int] = None,
+) -> dspy.LM:
+    """
+    One dspy LM per distinct setting, reused across requests instead of built per solve.
+    Sync calls from every LM go through litellm.client_session (see HTTP connection
+    pool), so they share one keep-alive pool — a per-(base_url, key) client would split it.
+    """
+    sampling = {k: v for k, v in (("temperature", temperature), ("max_tokens", max_tokens)) if v is not None}
+    return dspy.LM(model, api_key=api_key, api_base=base_url, **sampling)
+
 
-    def _is_reasoning_model(model: str) -> bool:
-        """OpenAI o-series reasoning models require temperature=1.0 and max_tokens>=16000."""
-        return bool(re.search(r'[/:]o[1-9](-|$|mini|preview|high)', model))
+# ── Cost-aware role routing ──────────────────────────────────────────────────
+# AI_ROUTING=cost|balanced|quality maps each ROMA role to a model tier: classification-
+# style roles (atomizer, verifier) run on the fast tier, long synthesis on the strongest.
+# Unset = every role uses the provider's default model (tiered only by token budget).
 
-    def make_cfg(llm: LLMConfig, temperature: float, max_tokens: int) -> AgentConfig:
-        cfg_llm = copy.copy(llm)
-        if _is_reasoning_model(getattr(cfg_llm, 'model', '')):
-            temperature = 1.0
-            max_tokens  = max(16000, max_tokens)
+_ROUTING_TIERS = {
+    "cost":     {"atomizer": "fast", "planner": "fast",  "executor": "fast",  "aggregator": "mid",   "verifier": "fast"},
+    "balanced": {"atomizer": "fast", "planner": "mid",   "executor": "mid",   "aggregator": "smart", "verifier": "fast"},
+    "quality":  {"atomizer": "mid",  "planner": "smart", "executor": "smart", "aggregator": "smart", "verifier": "mid"},
+}
+
+# model id → roles currently routed to it; lets the litellm callback attribute usage to a role
+_MODEL_ROLES: dict[str, str] = {}
+
+
+def build_role_llm_configs(
+    provider: str,
+    routing: str,
+    api_keys: Optional[dict] = None,
+) -> dict[str, LLMConfig]:
+    """Per-role LLMConfigs for a routing profile; one config per distinct tier."""
+    tiers = _ROUTING_TIERS.get(routing)
+    if tiers is None:
+        raise ValueError(f"Unknown AI_ROUTING '{routing}' — use: {' | '.join(_ROUTING_TIERS)}")
+    by_tier = {t: build_llm_config(provider, None, api_keys, tier=t)[0] for t in set(tiers.values())}
+    return {role: by_tier[t] for role, t in tiers.items()}
+
+
+def register_role_models(role_llms: Mapping[str, LLMConfig]) -> None:
+    """Record which roles each model serves — call with the final per-role configs, after any overrides."""
+    for model in {cfg.model for cfg in role_llms.values()}:
+        _MODEL_ROLES[model] = "+".join(r for r, cfg in role_llms.items() if cfg.model == model)
+
+
+@dataclass(frozen=True)
+class AgentCallCost:
+    role: str
+    model: str
+    input_tokens: int
+    output_tokens: int
+    cost: float
+
+
+def _log_call_cost(kwargs, completion_response, start_time, end_time) -> None:
+    """litellm success callback — one cost line per agent LLM call."""
+    model = kwargs.get("model", "")
+    usage = getattr(completion_response, "usage", None)
+    try:
+        cost = float(litellm.completion_cost(completion_response=completion_response) or 0.0)
+    except Exception:
+        cost = 0.0
+    # litellm may report the model with or without its provider prefix
+    role = _MODEL_ROLES.get(model) or next(
+        (r for m, r in _MODEL_ROLES.items() if m.split("/", 1)[-1] == model), "unrouted"
+    )
+    record = AgentCallCost(
+        role=role,
+        model=model,
+        input_tokens=getattr(usage, "prompt_tokens", 0) or 0,
+        output_tokens=getattr(usage, "completion_tokens", 0) or 0,
+        cost=cost,
+    )
+    log.info("llm_call", extra={
+        "role": record.role, "model": record.model,
+        "input_tokens": record.input_tokens, "output_tokens": record.output_tokens, "cost": round(record.cost, 5),
+    })
+
+
+litellm.success_callback.append(_log_call_cost)
+
+
+# ── Upstream rate limiting ───────────────────────────────────────────────────
+# Concurrent solves each issue many agent calls; without shaping, 3 solves × 10 calls
+# burst past a provider's RPM ceiling and the 429 aborts a half-finished solve.
+# The LLM call gate charges each call to its provider's <NAME>_RPM bucket in the pool
+# (grok 15/s and openrouter 60/s by default, others only when set; bursts up to 5 s of
+# budget) and waits out any deficit — asyncio.sleep on async calls.
+
+
+def _call_provider(call_kwargs: dict) -> Optional[str]:
+    """Which provider a litellm call goes to, by api_base then model prefix (grok/HF are openai/ models)."""
+    base = (call_kwargs.get("api_base") or call_kwargs.get("base_url") or "").rstrip("/")
+    if base == "https://api.x.ai/v1":
+        return "grok"
+    if base == "https://openrouter.ai/api/v1":
+        return "openrouter"
+    if base and base == _ENV.hf_base_url.rstrip("/"):
+        return "huggingface"
+    prefix = str(call_kwargs.get("model", "")).split("/", 1)[0]
+    return prefix if prefix in ("anthropic", "openai", "openrouter") else None
+
+
+def _reserve_call(call_kwargs: dict) -> float:
+    """Charge one LLM call to its provider's <NAME>_RPM/RPD budget; returns seconds to wait before sending."""
+    provider = _call_provider(call_kwargs)
+    if provider is None:
+        return 0.0
+    delay = _llm_pool.reserve(provider)
+    if delay > 0.5:
+        log.info("rpm_wait", extra={"provider": provider, "wait_s": round(delay, 2)})
+    return delay
+
+
+# Upper bound on executor subtasks dispatched concurrently per solve — keeps wall time ≈
+# slowest child instead of sum-of-children without bursting past provider limits. Reaches
+# ROMA only if its RuntimeConfig has max_concurrency (startup warns when it doesn't); always
+# bounds the fused path's dspy.Parallel.
+ROMA_MAX_PARALLEL = int(os.getenv("ROMA_MAX_PARALLEL", "8"))
+
+# Wall-clock budget for one /analyze solve (single provider or the whole multi-provider fan-out)
+SOLVE_TIMEOUT_S = float(os.getenv("ROMA_SOLVE_TIMEOUT_S", "700"))
+
+# Same-provider retries for a solve that fails with 429/5xx/network errors, before failover
+SOLVE_RETRIES = int(os.getenv("ROMA_SOLVE_RETRIES", "2"))
+
+# One bounded pool for every blocking solve() — a bulkhead on upstream LLM load that also
+# keeps solve threads off the loop's default executor (used by DNS, file I/O, to_thread).
+_SOLVE_POOL = ThreadPoolExecutor(
+    max_workers=int(os.getenv("ROMA_POOL_SIZE", "16")),
+    thread_name_prefix="roma-solve",
+)
+atexit.register(_SOLVE_POOL.shutdown, wait=False)
+
+
+def _in_solve_pool(fn, *args) -> asyncio.Future:
+    """Run fn(*args) on _SOLVE_POOL with the caller's contextvars, like asyncio.to_thread."""
+    ctx = contextvars.copy_context()
+    return asyncio.get_running_loop().run_in_executor(_SOLVE_POOL, functools.partial(ctx.run, fn, *args))
+
+
+class SolveCancelled(Exception):
+    """Raised inside a solve thread once its request has timed out or gone away."""
+
+
+# Per-request cancel flag. Cancelling the awaiting task cannot stop a solve thread, so
+# run_analyze sets this when it returns; the flag rides the contextvar through
+# _in_solve_pool into the solve thread, and into tasks and threads started via asyncio.run
+# or anyio.to_thread (both copy context). Plain thread pools don't copy it — dspy.Parallel
+# only forwards its own settings — so code fanning out that way must re-set it per task
+# (see fused_solve). threading.Event, not asyncio.Event — it is read from worker threads
+# and from the solve's own loop.
+_solve_cancel: contextvars.ContextVar[Optional[threading.Event]] = contextvars.ContextVar(
+    "solve_cancel", default=None,
+)
+_CANCEL_POLL_S = 0.25
+
+
+def _raise_if_cancelled(*_) -> None:
+    event = _solve_cancel.get()
+    if event is not None and event.is_set():
+        raise SolveCancelled("solve abandoned after its request timed out")
+
+
+# ── LLM call gate ────────────────────────────────────────────────────────────
+# ROMA builds its own dspy LMs from each AgentConfig and runs agents sync or async, so
+# neither a dspy.context LM nor a shared httpx client sees every agent call. All of them
+# do go through litellm.completion / litellm.acompletion (dspy looks both up on the
+# module at call time), so per-call policy lives in these two wrappers.
+
+_litellm_completion  = litellm.completion
+_litellm_acompletion = litellm.acompletion
+
+
+def _gated_completion(*args, **kwargs):
+    _raise_if_cancelled()
+    delay = _reserve_call(kwargs)
+    if delay > 0:
+        time.sleep(delay)
+        _raise_if_cancelled()
+    cached = _cache_anthropic_prompt(kwargs)
+    response = _litellm_completion(*args, **kwargs)
+    if cached:
+        _log_cache_usage(response)
+    return response
+
+
+async def _gated_acompletion(*args, **kwargs):
+    _raise_if_cancelled()
+    delay = _reserve_call(kwargs)
+    if delay > 0:
+        await asyncio.sleep(delay)  # never time.sleep here — it would stall the solve's event loop
+        _raise_if_cancelled()
+    cached = _cache_anthropic_prompt(kwargs)
+    event = _solve_cancel.get()
+    if event is None:  # not inside a solve (warm-up, /optimize)
+        response = await _litellm_acompletion(*args, **kwargs)
+    else:
+        # Async calls can be abandoned mid-flight: cancelling the task closes the socket,
+        # so the provider stops generating (and billing) for a 504'd request.
+        call = asyncio.ensure_future(_litellm_acompletion(*args, **kwargs))
+        while True:
+            done, _ = await asyncio.wait({call}, timeout=_CANCEL_POLL_S)
+            if done:
+                break
+            if event.is_set():
+                call.cancel()
+                raise SolveCancelled("solve abandoned after its request timed out")
+        response = call.result()
+    if cached:
+        _log_cache_usage(response)
+    return response
+
+
+litellm.completion  = _gated_completion
+litellm.acompletion = _gated_acompletion
+
+
+def _build_runtime_config() -> RuntimeConfig:
+    """RuntimeConfig with parallel child dispatch, when the installed SDK exposes the knob."""
+    kwargs: dict = {"timeout": SOLVE_TIMEOUT_S}
+    fields = getattr(RuntimeConfig, "model_fields", None) or getattr(RuntimeConfig, "__dataclass_fields__", {})
+    if "max_concurrency" in fields:
+        kwargs["max_concurrency"] = ROMA_MAX_PARALLEL
+    else:
+        log.warning("roma_max_concurrency_unsupported", extra={
+            "note": "RuntimeConfig has no max_concurrency — ROMA child dispatch uses the SDK default",
+        })
+    return RuntimeConfig(**kwargs)
+
+
+# Static per-role settings — only the LLM (model / key / base_url) varies per request.
+_ROLE_TEMPLATES = (
+    # role         llm tier         temperature
+    ("atomizer",   "orchestration", 0.1),
+    ("planner",    "orchestration", 0.3),
+    ("executor",   "analysis",      0.5),
+    ("aggregator", "analysis",      0.2),
+    ("verifier",   "orchestration", 0.1),
+)
+
+# Token budgets tuned to stay above content truncation point without excessive
+# generation time. Tiered by mode for wall-time predictability.
+_ROLE_MAX_TOKENS = {
+    "blitz": {"atomizer": 900,  "planner": 1200, "executor": 3000, "aggregator": 1500, "verifier": 500},
+    "sharp": {"atomizer": 1000, "planner": 1400, "executor": 3500, "aggregator": 1800, "verifier": 500},
+    "keen":  {"atomizer": 1000, "planner": 1600, "executor": 4000, "aggregator": 2000, "verifier": 500},
+    "smart": {"atomizer": 1200, "planner": 2000, "executor": 4500, "aggregator": 2500, "verifier": 500},
+}
+
+# Executor must always emit sources field (Optional in signature but JSONAdapter enforces it)
+_EXECUTOR_INSTRUCTIONS = (
+    "Always include ALL output fields in your JSON response. "
+    "The 'sources' field is required — if no sources were used, set it to an empty list: []"
+)
+
+# OpenAI o-series reasoning models require temperature=1.0 and max_tokens>=16000
+_REASONING_MODEL_RE = re.compile(r'[/:]o[1-9](-|$|mini|preview|high)')
+
+def _with_fields(obj, **changes):
+    """
+    Copy of a roma-dspy config object with fields replaced. The SDK's schema library isn't
+    pinned (pydantic model vs dataclass), so don't assume one: model_copy skips re-validation
+    when it exists, then dataclasses.replace, then copy + setattr as the original code did.
+    """
+    if hasattr(obj, "model_copy"):
+        return obj.model_copy(update=changes)
+    if dataclasses.is_dataclass(obj):
         try:
-            cfg_llm.temperature = temperature
-            cfg_llm.max_tokens = max_tokens
+            return dataclasses.replace(obj, **changes)
+        except TypeError:  # init=False fields — fall through to attribute assignment
+            pass
+    clone = copy.copy(obj)
+    for name, value in changes.items():
+        try:
+            setattr(clone, name, value)
         except Exception:
-            pass  # LLMConfig immutable — adapter still set via dspy.context in run_single_solve
-        return AgentConfig(llm=cfg_llm)
-
-    # Executor must always emit sources field (Optional in signature but JSONAdapter enforces it)
-    executor_cfg = make_cfg(analysis_llm, temperature=0.5, max_tokens=budgets["executor"])
-    executor_cfg.signature_instructions = (
-        "Always include ALL output fields in your JSON response. "
-        "The 'sources' field is required — if no sources were used, set it to an empty list: []"
-    )
+            log.warning("config_field_readonly", extra={"type": type(obj).__name__, "field": name})
+    return clone
+
+
+_RUNTIME    = _build_runtime_config()
+_BASE_AGENT = AgentConfig(llm=LLMConfig(model="openai/template", api_key="template"))
 
-    orch_budgets = {
-        "blitz": {"atomizer": 900,  "planner": 1200},
-        "sharp": {"atomizer": 1000, "planner": 1400},
-        "keen":  {"atomizer": 1000, "planner": 1600},
-        "smart": {"atomizer": 1200, "planner": 2000},
+
+def _agent_cfg(
+    llm: LLMConfig, temperature: float, max_tokens: int, shared: Optional[dict] = None, **extra
+) -> AgentConfig:
+    """
+    AgentConfig copied from the template (_with_fields) — no re-validation per role on pydantic.
+    shared: per-config memo so roles resolving to the same (llm, temperature, max_tokens)
+    get one LLMConfig instance, and with it one downstream LM / connection pool.
+    """
+    if _REASONING_MODEL_RE.search(llm.model or ""):
+        temperature = 1.0
+        max_tokens  = max(16000, max_tokens)
+    key = (id(llm), temperature, max_tokens)
+    cfg_llm = shared.get(key) if shared is not None else None
+    if cfg_llm is None:
+        cfg_llm = _with_fields(llm, temperature=temperature, max_tokens=max_tokens)
+        if shared is not None:
+            shared[key] = cfg_llm
+    return _with_fields(_BASE_AGENT, llm=cfg_llm, **extra)
+
+
+def build_roma_config_tiered(
+    analysis_llm: LLMConfig,
+    orchestration_llm: LLMConfig,
+    roma_mode: str = "keen",
+    role_llms: Optional[dict[str, LLMConfig]] = None,
+) -> ROMAConfig:
+    """
+    Tiered ROMA config — fastest quality mix:
+      Atomizer + Planner  → orchestration_llm (fast/cheap — just task decomposition)
+      Executor + Aggregator → analysis_llm (quality model — the actual reasoning)
+    role_llms: optional per-role overrides from build_role_llm_configs (AI_ROUTING).
+    """
+    budgets = _ROLE_MAX_TOKENS.get(roma_mode, _ROLE_MAX_TOKENS["keen"])
+    tier_llms = {"analysis": analysis_llm, "orchestration": orchestration_llm}
+    routed = role_llms or {}
+    shared: dict = {}  # tiers are usually the same LLMConfig instance (no model_override)
+
+    agents = {
+        role: _agent_cfg(
+            routed.get(role, tier_llms[tier]), temperature, budgets[role], shared,
+            **({"signature_instructions": _EXECUTOR_INSTRUCTIONS} if role == "executor" else {}),
+        )
+        for role, tier, temperature in _ROLE_TEMPLATES
     }
-    ob = orch_budgets.get(roma_mode, orch_budgets["keen"])
-
-    return ROMAConfig(
-        runtime=RuntimeConfig(timeout=700),
-        agents=AgentsConfig(
-            atomizer=make_cfg(orchestration_llm, temperature=0.1, max_tokens=ob["atomizer"]),
-            planner=make_cfg(orchestration_llm,  temperature=0.3, max_tokens=ob["planner"]),
-            executor=executor_cfg,
-            aggregator=make_cfg(analysis_llm,    temperature=0.2, max_tokens=budgets["aggregator"]),
-            verifier=make_cfg(orchestration_llm, temperature=0.1, max_tokens=500),
-        ),
+    return ROMAConfig(runtime=_RUNTIME, agents=AgentsConfig(**agents))
+
+
+# ROMAConfig objects are pure functions of the per-role LLM settings + mode — build each
+# combination once. Keys carry a small integer id for the API key, never the key itself.
+_roma_config_cache: LRUCache = LRUCache(maxsize=128)
+_roma_config_lock = threading.Lock()
+_api_key_ids: LRUCache = LRUCache(maxsize=1024)
+_next_api_key_id = itertools.count()
+
+
+def _api_key_id(api_key: Optional[str]) -> int:
+    """Stable id per API key — a dict hit instead of hashing the secret on every request."""
+    with _roma_config_lock:
+        key_id = _api_key_ids.get(api_key)
+        if key_id is None:
+            key_id = _api_key_ids[api_key] = next(_next_api_key_id)  # ids never reused after eviction
+        return key_id
+
+
+def _llm_key(llm: LLMConfig) -> tuple:
+    return (llm.model, _api_key_id(llm.api_key), getattr(llm, "base_url", None))
+
+
+def get_roma_config(
+    analysis_llm: LLMConfig,
+    orchestration_llm: LLMConfig,
+    roma_mode: str = "keen",
+    role_llms: Optional[dict[str, LLMConfig]] = None,
+) -> ROMAConfig:
+    """Memoized build_roma_config_tiered."""
+    key = (
+        _llm_key(analysis_llm),
+        _llm_key(orchestration_llm),
+        roma_mode,
+        tuple(sorted((role, _llm_key(cfg)) for role, cfg in (role_llms or {}).items())),
     )
+    with _roma_config_lock:
+        cfg = _roma_config_cache.get(key)
+    if cfg is None:
+        cfg = build_roma_config_tiered(analysis_llm, orchestration_llm, roma_mode, role_llms)
+        with _roma_config_lock:
+            _roma_config_cache[key] = cfg
+    return cfg
+
+
+# ── Fused orchestration ──────────────────────────────────────────────────────
+# Atomizer → Planner are two dependent orchestration-tier calls, so every decomposed solve
+# pays a full round trip between them. With ROMA_FUSE_ORCHESTRATOR=1 a depth-1 solve asks
+# one call for both the atomic decision and the subgoals, then runs executors in parallel
+# and aggregates — the same depth-1 tree, one fewer network hop. Deeper solves use the SDK.
+FUSE_ORCHESTRATOR = os.getenv("ROMA_FUSE_ORCHESTRATOR", "0") == "1"
+
+
+class FusedOrchestration(dspy.Signature):
+    """Decide whether the goal can be answered directly. If not, split it into independent subgoals that together answer it."""
+    goal: str = dspy.InputField()
+    is_atomic: bool = dspy.OutputField(desc="true when one analyst can answer the goal directly")
+    subgoals: list[str] = dspy.OutputField(desc="independent subgoals; empty when is_atomic")
+
+
+class ExecuteSubgoal(dspy.Signature):
+    """Answer the goal using the market context in the original request."""
+    goal: str = dspy.InputField()
+    context: str = dspy.InputField(desc="original request, including market context; empty when the goal is the request")
+    result: str = dspy.OutputField()
+
+
+class AggregateSubgoals(dspy.Signature):
+    """Synthesize the subgoal results into a single answer to the original goal."""
+    goal: str = dspy.InputField()
+    subgoal_results: list[str] = dspy.InputField()
+    result: str = dspy.OutputField()
+
+
+@dataclass(slots=True)
+class FusedNode:
+    """Solve result in the shape extract_answer reads from a roma-dspy TaskNode."""
+    goal: str
+    result: str
+    node_type: str = "EXECUTE"
+    task_id: str = ""
+    children: list = field(default_factory=list)
+
+
+def build_fused_orchestrator_config(orchestration_llm: LLMConfig, roma_mode: str = "keen") -> AgentConfig:
+    """Atomizer + planner as one agent: atomizer temperature, both roles' token budgets."""
+    budgets = _ROLE_MAX_TOKENS.get(roma_mode, _ROLE_MAX_TOKENS["keen"])
+    return _agent_cfg(orchestration_llm, 0.1, budgets["atomizer"] + budgets["planner"])
+
+
+def _agent_lm(agent: AgentConfig) -> dspy.LM:
+    llm = agent.llm
+    return shared_lm(llm.model, llm.api_key, llm.base_url, llm.temperature, llm.max_tokens)
+
+
+def fused_solve(goal: str, cfg: ROMAConfig, orchestrator: AgentConfig) -> FusedNode:
+    """Depth-1 solve with the atomizer and planner fused into one orchestration call."""
+    plan = dspy.Predict(FusedOrchestration)
+    plan.set_lm(_agent_lm(orchestrator))
+    executor = dspy.Predict(ExecuteSubgoal)
+    executor.set_lm(_agent_lm(cfg.agents.executor))
+
+    decision = plan(goal=goal)
+    subgoals = [g for g in (decision.subgoals or []) if g.strip()][:MAX_SUBTASKS_RETURNED]
+    if decision.is_atomic or not subgoals:
+        # goal already carries the market context — don't send the prompt twice
+        return FusedNode(goal=goal, result=executor(goal=goal, context="").result)
+
+    cancel = _solve_cancel.get()
+
+    def run_executor(**kwargs):
+        _solve_cancel.set(cancel)  # dspy.Parallel's worker threads don't inherit contextvars
+        return executor(**kwargs)
+
+    outputs = dspy.Parallel(num_threads=min(len(subgoals), ROMA_MAX_PARALLEL), disable_progress_bar=True)(
+        [(run_executor, {"goal": g, "context": goal}) for g in subgoals]
+    )
+    children = [
+        FusedNode(goal=g, result=out.result if out is not None else "", task_id=f"t{i+1}")
+        for i, (g, out) in enumerate(zip(subgoals, outputs))
+    ]
+    aggregator = dspy.Predict(AggregateSubgoals)
+    aggregator.set_lm(_agent_lm(cfg.agents.aggregator))
+    merged = aggregator(goal=goal, subgoal_results=[f"{c.goal}\n{c.result}" for c in children])
+    return FusedNode(goal=goal, result=merged.result, node_type="PLAN", children=children)
 
 
 # Configure global DSPy LM on startup — /analyze rebuilds per-request using caller's provider+keys.
 # Startup failure is non-fatal: requests with their own keys will still work.
+# async_max_workers sizes the thread pool DSPy uses to run blocking predict calls for
+# concurrently-dispatched ROMA children; 8 is DSPy's own default, so this only changes
+# anything when ROMA_MAX_PARALLEL is set to something else.
+dspy.configure(async_max_workers=ROMA_MAX_PARALLEL)
 try:
     _startup_llm, _provider_label = build_llm_config()
-    dspy.configure(lm=dspy.LM(
-        _startup_llm.model,
-        api_key=_startup_llm.api_key,
-        api_base=_startup_llm.base_url,
-    ))
-    print(f"[ROMA] LLM configured — provider: {_provider_label}, model: {_startup_llm.model}")
+    dspy.configure(lm=shared_lm(_startup_llm.model, _startup_llm.api_key, _startup_llm.base_url))
+    log.info("llm_configured", extra={"provider": _provider_label, "model": _startup_llm.model})
 except Exception as e:
+    _startup_llm = None
     _provider_label = "unknown"
-    print(f"[ROMA] Warning: startup LM configuration failed: {e}")
-    print("[ROMA] Service started — /analyze will work if caller provides valid provider+keys.")
+    log.warning("startup_llm_failed", extra={
+        "error": str(e), "note": "/analyze will work if caller provides valid provider+keys",
+    })
+
+if _ENV.ai_routing and not any(_tier_model(_ENV.ai_provider, t) for t in ("fast", "mid", "smart")):
+    log.warning("ai_routing_inert", extra={
+        "provider": _ENV.ai_provider, "routing": _ENV.ai_routing,
+        "note": f"no {_TIER_ENV_PREFIX.get(_ENV.ai_provider, '?')}_FAST/MID/SMART_MODEL set — every role uses the default model",
+    })
+
+_llm_cache = LLMCache.from_env()
+_semantic_cache = SemanticCache.from_env()
+_llm_pool = LLMPool.from_env()
+
+
+# ── Admission control ────────────────────────────────────────────────────────
+# Each solve holds a TaskNode tree and fans out many provider calls — past MAX_INFLIGHT
+# concurrent solves, shed load with 429 + Retry-After instead of queueing without bound.
+
+# Default matches ROMA_POOL_SIZE: admission only sheds once every solve thread is busy
+MAX_INFLIGHT = int(os.getenv("MAX_INFLIGHT", "16"))
+INFLIGHT_WAIT_S = float(os.getenv("INFLIGHT_WAIT_S", "0.1"))
+_INFLIGHT = anyio.Semaphore(MAX_INFLIGHT)  # _inflight_gauge / _rejected_429: see /metrics above
+
+
+def _reset_breakers_on_failover(provider: str) -> None:
+    """A failed provider trips ROMA's module breakers — clear them right before a fallback runs."""
+    log.warning("provider_failover", extra={"provider": provider})
+    module_circuit_breaker.reset_all()
+
+
+# ── Micro-batching ───────────────────────────────────────────────────────────
+# Bursts of /analyze calls for the same provider/keys/mode (a hot market streaming
+# updates) are merged into one solve when ROMA_BATCH=1: requests arriving within
+# BATCH_WINDOW_MS are asked as numbered queries and the JSON answer array is split back
+# out. A lone request is solved as-is, and an unparseable batch answer falls back to
+# solving each request separately, so batching never costs an answer.
+ENABLE_BATCHING = os.getenv("ROMA_BATCH", "0") == "1"
+BATCH_MAX       = int(os.getenv("BATCH_MAX", "8"))
+BATCH_WINDOW_MS = float(os.getenv("BATCH_WINDOW_MS", "25"))
+
+
+@dataclass(slots=True)
+class _BatchItem:
+    key: tuple
+    prompt: str
+    solve: Callable[[str], "SolveOutcome"]       # blocking: prompt -> (label, answer, was_atomic, subtasks)
+    future: asyncio.Future
+    context: contextvars.Context                 # submitter's contextvars (solve cancel flag)
+
+
+def _batch_prompt(prompts: list[str]) -> str:
+    queries = "\n\n".join(f"### Query {i}\n{p}" for i, p in enumerate(prompts, 1))
+    return (
+        f"Analyze {len(prompts)} independent market queries. Answer each one separately, "
+        "using only the context given with that query.\n"
+        'Return ONLY a JSON array with one entry per query: [{"id": 1, "answer": "..."}, ...]\n\n'
+        f"{queries}"
+    )
+
+
+def _split_batch_answer(text: str, n: int) -> Optional[list[str]]:
+    """Per-query answers from a batched solve, or None if the array is malformed or incomplete."""
+    try:
+        rows = orjson.loads(_strip_json_fences(text))
+        answers = {int(row["id"]): str(row["answer"]) for row in rows}
+    except (orjson.JSONDecodeError, TypeError, KeyError, ValueError):
+        return None
+    if sorted(answers) != list(range(1, n + 1)):
+        return None
+    return [answers[i] for i in range(1, n + 1)]
+
+
+class SolveBatcher:
+    """Collects solves for up to window_s and runs each same-key group as one solve."""
+
+    def __init__(self, max_items: int, window_s: float):
+        self.max_items = max_items
+        self.window_s  = window_s
+        self._queue: asyncio.Queue[_BatchItem] = asyncio.Queue()
+        self._drainer: Optional[asyncio.Task] = None
+
+    async def submit(self, key: tuple, prompt: str, solve_fn: Callable[[str], "SolveOutcome"]) -> "SolveOutcome":
+        if self._drainer is None or self._drainer.done():
+            self._drainer = asyncio.create_task(self._drain())
+        future = asyncio.get_running_loop().create_future()
+        await self._queue.put(_BatchItem(key, prompt, solve_fn, future, contextvars.copy_context()))
+        return await future
+
+    async def _drain(self) -> None:
+        loop = asyncio.get_running_loop()
+        while True:
+            items = [await self._queue.get()]
+            deadline = loop.time() + self.window_s
+            while len(items) < self.max_items and (remaining := deadline - loop.time()) > 0:
+                try:
+                    items.append(await asyncio.wait_for(self._queue.get(), remaining))
+                except TimeoutError:
+                    break
+            try:
+                groups: dict[tuple, list[_BatchItem]] = {}
+                for item in items:
+                    groups.setdefault(item.key, []).append(item)
+            except Exception as e:  # e.g. an unhashable key — fail these waiters, keep draining
+                log.exception("batch_group_failed")
+                self._fail(items, e)
+                continue
+            for group in groups.values():
+                try:
+                    group[0].context.run(asyncio.create_task, self._run(group))  # solve under the leader's context
+                except Exception as e:
+                    self._fail(group, e)
+
+    @staticmethod
+    def _fail(items: list[_BatchItem], exc: BaseException) -> None:
+        for item in items:
+            if not item.future.done():
+                item.future.set_exception(exc)
+
+    @staticmethod
+    async def _run_one(item: _BatchItem) -> None:
+        try:
+            result = await item.context.run(_in_solve_pool, item.solve, item.prompt)
+        except Exception as e:
+            if not item.future.done():
+                item.future.set_exception(e)
+            return
+        if not item.future.done():  # waiter may have timed out
+            item.future.set_result(result)
+
+    async def _run(self, group: list[_BatchItem]) -> None:
+        if len(group) == 1:
+            await self._run_one(group[0])
+            return
+        try:
+            label, text, _, _ = await _in_solve_pool(group[0].solve, _batch_prompt([i.prompt for i in group]))
+        except Exception as e:
+            self._fail(group, e)
+            return
+        answers = _split_batch_answer(text, len(group))
+        if answers is None:
+            log.warning("batch_unparseable", extra={"size": len(group)})  # solving individually
+            await asyncio.gather(*(self._run_one(item) for item in group))
+            return
+        log.info("batch_solved", extra={"size": len(group), "provider": label})
+        for item, answer in zip(group, answers):
+            if not item.future.done():
+                item.future.set_result((label, answer, True, []))
+
+
+_batcher = SolveBatcher(BATCH_MAX, BATCH_WINDOW_MS / 1000) if ENABLE_BATCHING else None
+
+
+# ── Prompt preprocessing ─────────────────────────────────────────────────────
+
+def dedup_context(context: str, delimiter: str = "\n\n") -> str:
+    """
+    Drop byte-identical repeated chunks (order-book snapshots, repeated headlines)
+    from the market context, keeping the first occurrence and original order.
+    Lossless — the model sees every distinct chunk exactly once.
+    """
+    seen: set = set()
+    kept: list[str] = []
+    for chunk in context.split(delimiter):
+        digest = _chunk_digest(chunk)
+        if digest not in seen:
+            seen.add(digest)
+            kept.append(chunk)
+    return delimiter.join(kept)
+
+
+CONTEXT_VOLATILE_BUCKETS = 2   # chunks in the newest N ts_buckets go after the cacheable prefix
+
+
+def build_context_pack(chunks: list["ContextChunk"]) -> tuple[str, str, str]:
+    """
+    Canonicalize context chunks so the same market data always yields the same bytes.
+    Sorted by (source, ts_bucket, text); chunks older than the newest CONTEXT_VOLATILE_BUCKETS
+    form the stable block that leads the prompt. Returns (stable, volatile, context_version).
+    """
+    ordered = sorted(chunks, key=lambda c: (c.source, c.ts_bucket, c.text))
+    latest = max((c.ts_bucket for c in ordered), default=0)
+    cutoff = latest - CONTEXT_VOLATILE_BUCKETS + 1
+    stable   = "\n\n".join(c.text for c in ordered if c.ts_bucket < cutoff)
+    volatile = "\n\n".join(c.text for c in ordered if c.ts_bucket >= cutoff)
+    version  = hashlib.md5(f"{stable}\x00{volatile}".encode()).hexdigest()
+    return stable, volatile, version
+
+
+# ── HTTP connection pool ─────────────────────────────────────────────────────
+# Keep-alive pool for litellm's *sync* OpenAI-compatible calls (dspy LM.forward: the
+# fused path, warm-up, sync ROMA agents); HTTP/2 multiplexes them when h2 is installed.
+# Async agent calls use litellm's own cached async clients — an httpx.AsyncClient is
+# bound to one event loop and each solve runs its own, so it can't be shared here.
+
+def _build_http_client() -> httpx.Client:
+    try:
+        import h2  # noqa: F401
+        http2 = True
+    except ImportError:
+        http2 = False
+    return httpx.Client(
+        http2=http2,
+        limits=httpx.Limits(max_connections=100, max_keepalive_connections=50, keepalive_expiry=90.0),
+        # No single LLM read may outlive the whole solve budget; fail fast on connect / pool waits
+        timeout=httpx.Timeout(connect=5.0, read=SOLVE_TIMEOUT_S, write=5.0, pool=5.0),
+    )
+
+
+_http_client = _build_http_client()
+litellm.client_session = _http_client
+
+# Providers whose LLMConfig carries no base_url (litellm uses its built-in endpoint)
+_DEFAULT_BASE_URLS = {
+    "anthropic/": "https://api.anthropic.com",
+    "openai/":    "https://api.openai.com/v1",
+}
+
+
+def _warm_connections() -> None:
+    """Open a keep-alive TLS connection to the default provider so the first /analyze skips the handshake."""
+    if _startup_llm is None:
+        return
+    base_url = getattr(_startup_llm, "base_url", None) or next(
+        (url for prefix, url in _DEFAULT_BASE_URLS.items() if _startup_llm.model.startswith(prefix)), None
+    )
+    if base_url:
+        try:
+            _http_client.head(base_url, timeout=5.0)
+            log.info("pool_warmed", extra={"base_url": base_url})
+        except Exception as e:
+            log.warning("pool_warmup_failed", extra={"base_url": base_url, "error": str(e)})
+    if os.getenv("WARMUP_LLM") == "1":
+        # 1-token completion also primes litellm's client + the provider's request path
+        try:
+            dspy.settings.lm("ping", max_tokens=1)
+        except Exception as e:
+            log.warning("llm_warmup_failed", extra={"error": str(e)})
+
+
+@app.on_event("startup")
+async def warmup():
+    # Background — a slow or unreachable provider must not delay startup
+    asyncio.get_running_loop().run_in_executor(None, _warm_connections)
 
 
 # ── Request / Response models ─────────────────────────────────────────────────
+# msgspec Structs — /analyze decodes + validates the body straight into these and
+# encodes the reply without a pydantic validator tree (see _decode_analyze_request).
+
+class ContextChunk(msgspec.Struct, frozen=True, gc=False):
+    source: str        # e.g. "orderbook" | "news" | "ticks"
+    ts_bucket: int     # caller-defined time bucket; higher = newer
+    text: str
+
+
+# Enums validate provider / mode at decode time (422 on a typo) instead of deep inside
+# build_llm_config. StrEnum members hash and compare as their string value, so the
+# str-keyed tables (_PROVIDER_HANDLERS, _ROLE_MAX_TOKENS, ...) take them unchanged.
+class Provider(StrEnum):
+    anthropic   = "anthropic"
+    openai      = "openai"
+    grok        = "grok"
+    openrouter  = "openrouter"
+    huggingface = "huggingface"
+
+
+class RomaMode(StrEnum):
+    blitz = "blitz"
+    sharp = "sharp"
+    keen  = "keen"
+    smart = "smart"
+
 
-class AnalyzeRequest(BaseModel):
+class AnalyzeRequest(msgspec.Struct, frozen=True):
     goal: str
-    context: str
+    context: str = ""                      # opaque context — ignored when context_chunks is set
+    context_chunks: Optional[list[ContextChunk]] = None  # canonicalized into a versioned context pack
     max_depth: Optional[int] = 1
     beam_width: Optional[int] = None       # parallel executor beams; None = SDK default
-    roma_mode: Optional[str] = "keen"      # blitz | sharp | keen | smart — controls token budgets
-    provider: Optional[str] = None         # overrides AI_PROVIDER env
-    providers: Optional[list[str]] = None  # multi-provider parallel solve — merges answers
+    roma_mode: Optional[RomaMode] = RomaMode.keen  # blitz | sharp | keen | smart — controls token budgets
+    provider: Optional[Provider] = None            # overrides AI_PROVIDER env
+    providers: Optional[list[Provider]] = None     # multi-provider parallel solve — merges answers
     model_override: Optional[str] = None   # override specific model ID
-    api_keys: Optional[dict] = None        # per-provider API keys {'openrouter': '...', ...}
+    api_keys: Optional[dict[str, str]] = None  # per-provider API keys {'openrouter': '...', ...}
+    deterministic: Optional[bool] = False  # opt in to the exact-match response cache
 
 
-class SubtaskResult(BaseModel):
+MAX_SUBTASKS_RETURNED = 32                       # planner fan-out beyond this isn't surfaced
+_subtask_fields = attrgetter("task_id", "goal", "result")
+
+
+# gc=False: str/int-only structs can't form reference cycles, so the cyclic GC never needs
+# to track them — a 32-subtask response no longer adds 32 objects to every collection pass.
+class SubtaskResult(msgspec.Struct, gc=False):
     id: str
     goal: str
     result: str
 
 
-class AnalyzeResponse(BaseModel):
+class AnalyzeResponse(msgspec.Struct):
     answer: str
     was_atomic: bool
     subtasks: list[SubtaskResult]
     duration_ms: int
     provider: str
+    cache_hit: bool = False
+    dedup_ratio: float = 0.0   # fraction of context bytes removed by dedup_context
+    context_version: Optional[str] = None  # md5 of the canonical context pack (context_chunks only)
+
+
+_analyze_decoder = msgspec.json.Decoder(AnalyzeRequest)
+_json_encoder    = msgspec.json.Encoder()
+
+
+# (provider_label, answer, was_atomic, subtasks) — what a solve thread hands back to the loop
+SolveOutcome = tuple[str, str, bool, list[SubtaskResult]]
+
+
+def extract_answer(result: object) -> tuple[str, bool, list[SubtaskResult]]:
+    """
+    Extract answer string, was_atomic flag, and subtasks from a solve result.
+    Pure Python string work on a possibly large tree — call it on the solve thread.
+    """
+    if isinstance(result, str):
+        return result, True, []
+
+    # Use result.result; only fall back to result.goal if result is explicitly None
+    # (not just falsy — empty string answer is still a valid answer)
+    raw_result = getattr(result, "result", None)
+    raw_goal   = getattr(result, "goal", None)
+    answer = str(raw_result if raw_result is not None else (raw_goal or result))
+
+    node_type_str = str(getattr(result, "node_type", "")).upper()
+    was_atomic = "PLAN" not in node_type_str
+    children = (getattr(result, "children", None) or [])[:MAX_SUBTASKS_RETURNED]
+    subtasks = [
+        SubtaskResult(
+            id=str(tid or f"t{i+1}")[:8], goal=str(g or ""), result=str(r or ""),
+        )
+        for i, (tid, g, r) in enumerate(map(_subtask_fields, children))
+    ]
+    return answer, was_atomic, subtasks
+
+
+async def _decode_analyze_request(request: Request) -> AnalyzeRequest:
+    try:
+        return _analyze_decoder.decode(await request.body())
+    except msgspec.DecodeError as e:
+        raise HTTPException(status_code=422, detail=str(e))
 
 
 # ── Endpoints ────────────────────────────────────────────────────────────────
@@ -247,71 +1263,160 @@ def reset_breakers():
     return {"status": "reset", "message": "All circuit breakers reset to CLOSED"}
 
 
+@app.post("/reset-config")
+def reset_config():
+    """
+    Re-apply .env and rebuild request-path config: provider keys/models/routing (EnvSnapshot),
+    memoized LLM + ROMA configs, and the failover pool (AI_FALLBACK_PROVIDERS, <NAME>_RPM/RPD,
+    PROVIDER_COOLDOWN_S). Real environment variables still win over .env. Process-level knobs
+    read at import — timeouts, pool sizes, MAX_INFLIGHT, batching, caches — need a restart.
+    """
+    global _ENV, _llm_pool
+    for key, value in dotenv_values().items():
+        if key not in _REAL_ENV_KEYS and value is not None:
+            os.environ[key] = value
+    _ENV = EnvSnapshot.from_environ()
+    _llm_pool = LLMPool.from_env()
+    _cached_llm_config.cache_clear()
+    with _roma_config_lock:
+        _roma_config_cache.clear()
+    return {"status": "reset", "provider": _ENV.ai_provider, "roma_mode": _ENV.roma_mode}
+
+
+@app.get("/pool-stats")
+def pool_stats():
+    """Connection counts for the shared LLM HTTP pool."""
+    pool = getattr(getattr(_http_client, "_transport", None), "_pool", None)
+    connections = list(getattr(pool, "connections", []) or [])
+    return {
+        "http2": bool(getattr(pool, "_http2", False)),
+        "num_connections": len(connections),
+        "idle_connections": sum(1 for c in connections if c.is_idle()),
+    }
+
+
 @app.get("/health")
 def health():
-    primary   = os.getenv("AI_PROVIDER", "grok")
-    provider2 = os.getenv("AI_PROVIDER2", "")
-    roma_mode = os.getenv("ROMA_MODE", "keen")
     return {
         "status": "ok",
-        "provider": primary,
-        "provider2": provider2 or None,
-        "roma_mode": roma_mode,
+        "provider": _ENV.ai_provider,
+        "provider2": _ENV.ai_provider2,
+        "fallbacks": _llm_pool.fallbacks or None,
+        "roma_mode": _ENV.roma_mode,
         "sdk": "roma-dspy",
     }
 
 
-@app.post("/analyze", response_model=AnalyzeResponse)
-def analyze(req: AnalyzeRequest):
+async def run_analyze(req: AnalyzeRequest, callbacks: Optional[list] = None) -> AnalyzeResponse:
     """
     Run the actual ROMA recursive solve loop on a trading goal + market context.
     Each request builds its own LLM config from the caller's provider + keys —
     startup env vars are only the default fallback.
+    callbacks: optional dspy callbacks installed for the duration of each solve.
     """
     roma_mode = req.roma_mode or "keen"
-    active_providers = req.providers if req.providers else [req.provider or os.getenv("AI_PROVIDER", "grok")]
+    active_providers = req.providers if req.providers else [req.provider or _ENV.ai_provider]
 
     # Build LLM configs from request — raises ValueError with a clear message if keys are missing
     try:
+        # Orchestration tier is resolved per provider inside run_single_solve
         analysis_llm, provider_label = build_llm_config(active_providers[0], req.model_override, req.api_keys)
-        orchestration_llm, _         = build_llm_config(active_providers[0], None, req.api_keys)
     except ValueError as e:
         raise HTTPException(status_code=503, detail=str(e))
 
-    print(f"[ROMA] /analyze  mode={roma_mode}  providers={active_providers}  model={analysis_llm.model}")
+    log.info("analyze", extra={"mode": roma_mode, "providers": active_providers, "model": analysis_llm.model})
+
+    start = time.perf_counter()
+
+    context_version: Optional[str] = None
+    if req.context_chunks:
+        # Stable block first so provider prefix caches survive fresh ticks in the tail
+        stable, volatile, context_version = build_context_pack(req.context_chunks)
+        raw_len = len(stable) + len(volatile)
+        stable, volatile = dedup_context(stable), dedup_context(volatile)
+        dedup_ratio = round(1 - (len(stable) + len(volatile)) / raw_len, 4) if raw_len else 0.0
+        full_prompt = f"""{req.goal}
 
-    start = time.time()
+Market context (stable):
+{stable}
 
-    full_prompt = f"""{req.goal}
+{_VOLATILE_MARKER}{volatile}"""
+    else:
+        context = dedup_context(req.context)
+        dedup_ratio = round(1 - len(context) / len(req.context), 4) if req.context else 0.0
+        full_prompt = f"""{req.goal}
 
-Market context:
-{req.context}"""
+{_CONTEXT_MARKER}{context}"""
 
-    beam_width = req.beam_width or int(os.getenv("ROMA_BEAM_WIDTH", "2"))
+    beam_width = req.beam_width or _ENV.roma_beam_width
+
+    # Exact-match cache — for callers that flag the request deterministic, since
+    # executor/aggregator sample at temperature > 0 and answers otherwise vary run to run.
+    # ROMA_CACHE_TTL opts every request in for a short window (repeat polls of a hot market).
+    cache_key: Optional[str] = None
+    if req.deterministic or RESPONSE_TTL > 0:
+        cache_key = make_cache_key(
+            m=analysis_llm.model, providers=active_providers, mode=roma_mode, r=_ENV.ai_routing,
+            p=full_prompt, d=req.max_depth, b=beam_width,
+        )
+        cached = await _llm_cache.get(cache_key)
+        if cached is not None:
+            duration_ms = int((time.perf_counter() - start) * 1000)
+            log.info("cache_hit", extra={"provider": cached["provider"], "duration_ms": duration_ms})
+            return msgspec.convert({**cached, "duration_ms": duration_ms, "cache_hit": True}, AnalyzeResponse)
+
+    # Semantic cache — near-duplicate prompts (reordered rows, fresh timestamps) reuse an answer
+    semantic_vec = None
+    semantic_scope = f"{analysis_llm.model}|{'+'.join(active_providers)}|{roma_mode}|{_ENV.ai_routing}|{req.max_depth}"
+    if _semantic_cache is not None:
+        semantic_vec = await anyio.to_thread.run_sync(_semantic_cache.embed, full_prompt)
+        similar = await anyio.to_thread.run_sync(_semantic_cache.lookup, semantic_vec, semantic_scope)
+        if similar is not None:
+            duration_ms = int((time.perf_counter() - start) * 1000)
+            log.info("semantic_cache_hit", extra={"provider": similar["provider"], "duration_ms": duration_ms})
+            return msgspec.convert({**similar, "duration_ms": duration_ms, "cache_hit": True}, AnalyzeResponse)
 
     # Check beam_width support once — avoids silent retry masking real TypeErrors
     _beam_width_supported: Optional[bool] = None
 
-    def run_single_solve(prov: str) -> tuple[str, object]:
+    def run_single_solve(prov: str, prompt: Optional[str] = None) -> tuple[str, object]:
         """Run one ROMA solve for a given provider; returns (provider_label, result)."""
         nonlocal _beam_width_supported
-        a_llm, p_label = build_llm_config(prov, req.model_override, req.api_keys)
-        o_llm, _       = build_llm_config(prov, None, req.api_keys)
-        cfg = build_roma_config_tiered(a_llm, o_llm, roma_mode)
+        _raise_if_cancelled()
+        goal = prompt or full_prompt
+        # model_override names a model on the requested provider — not valid on a fallback
+        model_override = req.model_override if prov in active_providers else None
+        (a_llm, p_label), (o_llm, _) = build_llm_configs_pair(prov, model_override, req.api_keys)
+        role_llms: Optional[dict[str, LLMConfig]] = None
+        if _ENV.ai_routing:
+            role_llms = build_role_llm_configs(prov, _ENV.ai_routing, req.api_keys)
+            if model_override:
+                # Caller pinned a model — keep it on the reasoning roles, route only orchestration
+                role_llms.update(executor=a_llm, aggregator=a_llm)
+            register_role_models(role_llms)
+        cfg = get_roma_config(a_llm, o_llm, roma_mode, role_llms)
         solve_kwargs: dict = {"max_depth": req.max_depth, "config": cfg}
 
         # For OpenRouter: force ChatAdapter at the DSPy global level for the entire solve.
         # Per-agent adapter_type config alone isn't enough — context propagation through
         # ROMA's async retry decorators loses the per-agent setting.
-        use_chat_adapter = prov == "openrouter"
-        ctx_adapter = dspy.ChatAdapter() if use_chat_adapter else None
+        ctx_overrides: dict = {}
+        if prov == "openrouter":
+            ctx_overrides["adapter"] = dspy.ChatAdapter()
+        if callbacks:
+            ctx_overrides["callbacks"] = callbacks
+
+        if FUSE_ORCHESTRATOR and req.max_depth == 1:
+            orchestrator = build_fused_orchestrator_config(role_llms.get("planner", o_llm) if role_llms else o_llm, roma_mode)
+            with dspy.context(**ctx_overrides):
+                return p_label, fused_solve(goal, cfg, orchestrator)
 
         def _do_solve(with_beam: bool):
             kw = {**solve_kwargs, "beam_width": beam_width} if with_beam else solve_kwargs
-            if ctx_adapter is not None:
-                with dspy.context(adapter=ctx_adapter):
-                    return solve(full_prompt, **kw)
-            return solve(full_prompt, **kw)
+            if ctx_overrides:
+                with dspy.context(**ctx_overrides):
+                    return solve(goal, **kw)
+            return solve(goal, **kw)
 
         # Probe beam_width support on first call; cache result for parallel workers
         if _beam_width_supported is None:
@@ -327,83 +1432,232 @@ Market context:
 
         return p_label, _do_solve(with_beam=_beam_width_supported)
 
-    def extract_answer(result: object) -> tuple[str, bool, list]:
-        """Extract answer string, was_atomic flag, and subtasks from a solve result."""
-        if isinstance(result, str):
-            return result, True, []
-
-        # Use result.result; only fall back to result.goal if result is explicitly None
-        # (not just falsy — empty string answer is still a valid answer)
-        raw_result = getattr(result, "result", None)
-        raw_goal   = getattr(result, "goal", None)
-        answer = str(raw_result if raw_result is not None else (raw_goal or result))
-
-        node_type_str = str(getattr(result, "node_type", "")).upper()
-        was_atomic = "PLAN" not in node_type_str
-        children = getattr(result, "children", []) or []
-        subtasks = [
-            SubtaskResult(
-                id=str(getattr(c, "task_id", f"t{i+1}"))[:8],
-                goal=str(getattr(c, "goal", "")),
-                result=str(getattr(c, "result", "") or ""),
-            )
-            for i, c in enumerate(children)
-        ]
-        return answer, was_atomic, subtasks
+    solve_deadline = time.monotonic() + SOLVE_TIMEOUT_S
+
+    def solve_with_retry(prov: str, prompt: Optional[str] = None) -> tuple[str, object]:
+        return retry_transient(
+            functools.partial(run_single_solve, prov, prompt),
+            retries=SOLVE_RETRIES, deadline=solve_deadline, should_stop=cancel_event.is_set,
+        )
+
+    def solve_and_extract(prov: str, prompt: Optional[str] = None) -> SolveOutcome:
+        """solve_with_retry + extract_answer, both on the worker thread."""
+        label, result = solve_with_retry(prov, prompt)
+        return (label, *extract_answer(result))
+
+    def solve_with_failover(prompt: str) -> SolveOutcome:
+        label, result = _llm_pool.run(
+            active_providers[0], functools.partial(solve_with_retry, prompt=prompt), _reset_breakers_on_failover,
+            should_stop=cancel_event.is_set,
+            configured=functools.partial(_provider_configured, api_keys=req.api_keys),
+        )
+        return (label, *extract_answer(result))
+
+    cancel_event = threading.Event()
+    _solve_cancel.set(cancel_event)
+
+    try:
+        with anyio.fail_after(INFLIGHT_WAIT_S):
+            await _INFLIGHT.acquire()
+    except TimeoutError:
+        if _rejected_429 is not None:
+            _rejected_429.inc()
+        raise HTTPException(status_code=429, detail="Server busy", headers={"Retry-After": "2"})
+    if _inflight_gauge is not None:
+        _inflight_gauge.inc()
 
     try:
         if len(active_providers) == 1:
-            # ── Single-provider solve (standard path) ─────────────────────────
-            prov_label, result = run_single_solve(active_providers[0])
-            answer, was_atomic, subtasks = extract_answer(result)
-            duration_ms = int((time.time() - start) * 1000)
-            print(f"[ROMA] done  provider={prov_label}  duration={duration_ms}ms")
+            # ── Single-provider solve (standard path, with provider failover) ─
+            if _batcher is not None and not callbacks:
+                batch_key = (
+                    active_providers[0], req.model_override, tuple(sorted((req.api_keys or {}).items())),
+                    roma_mode, req.max_depth, beam_width,
+                )
+                pending_solve = _batcher.submit(batch_key, full_prompt, solve_with_failover)
+            else:
+                pending_solve = _in_solve_pool(solve_with_failover, full_prompt)
+            prov_label, answer, was_atomic, subtasks = await asyncio.wait_for(pending_solve, timeout=SOLVE_TIMEOUT_S)
+            duration_ms = int((time.perf_counter() - start) * 1000)
+            log.info("analyze_done", extra={"provider": prov_label, "duration_ms": duration_ms})
 
         else:
             # ── Multi-provider parallel solve ─────────────────────────────────
-            print(f"[ROMA] parallel solve across {len(active_providers)} providers")
-            results_map: dict[str, tuple[str, object]] = {}
-
-            with ThreadPoolExecutor(max_workers=len(active_providers)) as ex:
-                future_to_prov = {ex.submit(run_single_solve, p): p for p in active_providers}
-                for future in as_completed(future_to_prov):
-                    prov = future_to_prov[future]
-                    try:
-                        prov_label, res = future.result()
-                        results_map[prov] = (prov_label, res)
-                    except Exception as e:
-                        print(f"[ROMA] provider {prov} failed: {e}")
-
-            if not results_map:
+            log.info("parallel_solve", extra={"providers": active_providers})
+            tasks = {asyncio.ensure_future(_in_solve_pool(solve_and_extract, p)): p for p in active_providers}
+            done, pending = await asyncio.wait(tasks, timeout=SOLVE_TIMEOUT_S)
+            for task in pending:
+                task.cancel()  # stop waiting — merge whatever finished inside the budget
+                log.warning("provider_timeout", extra={"provider": tasks[task], "timeout_s": SOLVE_TIMEOUT_S})
+
+            outcomes: list[SolveOutcome] = []
+            for task, prov in tasks.items():  # request order, not completion order
+                if task not in done:
+                    continue
+                if task.exception() is not None:
+                    log.warning("provider_failed", extra={"provider": prov, "error": str(task.exception())})
+                else:
+                    outcomes.append(task.result())
+
+            if not outcomes:
+                if pending:
+                    raise TimeoutError
                 raise RuntimeError("All providers failed in parallel solve")
 
-            parts: list[str] = []
-            all_subtasks: list[SubtaskResult] = []
-            combined_labels: list[str] = []
-            for prov, (lbl, res) in results_map.items():
-                ans, atomic, subs = extract_answer(res)
-                parts.append(f"[{lbl}]\n{ans}")
-                all_subtasks.extend(subs)
-                combined_labels.append(lbl)
-
-            answer     = "\n\n---\n\n".join(parts)
-            was_atomic = len(all_subtasks) == 0
-            subtasks   = all_subtasks
-            prov_label = " + ".join(combined_labels)
-            duration_ms = int((time.time() - start) * 1000)
-            print(f"[ROMA] parallel done  providers={prov_label}  duration={duration_ms}ms")
-
-        return AnalyzeResponse(
+            # Answers were extracted on the solve threads — only joins left for the loop
+            answer     = "\n\n---\n\n".join([f"[{lbl}]\n{ans}" for lbl, ans, _, _ in outcomes])
+            subtasks   = [sub for _, _, _, subs in outcomes for sub in subs]
+            was_atomic = not subtasks
+            prov_label = " + ".join([lbl for lbl, _, _, _ in outcomes])
+            duration_ms = int((time.perf_counter() - start) * 1000)
+            log.info("parallel_done", extra={"provider": prov_label, "duration_ms": duration_ms})
+
+        response = AnalyzeResponse(
             answer=answer,
             was_atomic=was_atomic,
             subtasks=subtasks,
             duration_ms=duration_ms,
             provider=prov_label,
+            dedup_ratio=dedup_ratio,
+            context_version=context_version,
         )
+        if cache_key is not None:
+            await _llm_cache.set(
+                cache_key, msgspec.to_builtins(response), ttl=DEFAULT_TTL if req.deterministic else RESPONSE_TTL,
+            )
+        if semantic_vec is not None:
+            await anyio.to_thread.run_sync(_semantic_cache.add, semantic_vec, semantic_scope, msgspec.to_builtins(response))
+        return response
 
+    except TimeoutError:
+        log.warning("roma_solve_timeout", extra={"mode": roma_mode, "provider": "+".join(active_providers)})
+        raise HTTPException(status_code=504, detail=f"ROMA solve timed out after {SOLVE_TIMEOUT_S:.0f}s")
     except Exception as e:
-        traceback.print_exc()
+        log.exception(
+            "roma_solve_failed",
+            extra={
+                "mode": roma_mode,
+                "provider": "+".join(active_providers),
+                "model": analysis_llm.model,
+                "duration_ms": int((time.perf_counter() - start) * 1000),
+            },
+        )
         raise HTTPException(status_code=500, detail=f"ROMA solve failed: {str(e)}")
+    finally:
+        cancel_event.set()  # any solve thread still running for this request stops at its next LLM call
+        _INFLIGHT.release()
+        if _inflight_gauge is not None:
+            _inflight_gauge.dec()
+
+
+@app.post("/analyze")
+async def analyze(request: Request):
+    """Run ROMA on a goal + market context (AnalyzeRequest JSON) and return an AnalyzeResponse."""
+    response = await run_analyze(await _decode_analyze_request(request))
+    headers = {"X-Context-Version": response.context_version} if response.context_version else None
+    return Response(content=_json_encoder.encode(response), media_type="application/json", headers=headers)
+
+
+# ── Streaming ────────────────────────────────────────────────────────────────
+
+_ROMA_ROLES = ("Atomizer", "Planner", "Executor", "Aggregator", "Verifier")
+# fused_solve runs plain dspy.Predict modules — identify them by signature instead
+_FUSED_ROLES = {"FusedOrchestration": "planner", "ExecuteSubgoal": "executor", "AggregateSubgoals": "aggregator"}
+
+
+def _roma_role(instance) -> Optional[str]:
+    name = type(instance).__name__
+    role = next((r.lower() for r in _ROMA_ROLES if r in name), None)
+    if role is None:
+        role = _FUSED_ROLES.get(getattr(getattr(instance, "signature", None), "__name__", ""))
+    return role
+
+
+class _SolveEventCallback(BaseCallback):
+    """
+    Forwards ROMA agent completions from solver threads onto a stream's asyncio queue.
+    Executor completions are also sent as subtask_done the moment they finish, so clients
+    see each child's result without waiting for the aggregator.
+    """
+
+    def __init__(self, loop: asyncio.AbstractEventLoop, queue: asyncio.Queue):
+        self._loop    = loop
+        self._queue   = queue
+        self._modules: dict[str, tuple[str, str]] = {}
+        self._subtask_ids = itertools.count(1)
+        self.subtasks_streamed = 0
+
+    def _emit(self, event: str, data: dict) -> None:
+        self._loop.call_soon_threadsafe(self._queue.put_nowait, (event, data))
+
+    def on_module_start(self, call_id, instance, inputs):
+        role = _roma_role(instance)
+        if role is not None:
+            self._modules[call_id] = (role, str((inputs or {}).get("goal", ""))[:500])
+
+    def on_module_end(self, call_id, outputs, exception=None):
+        role, goal = self._modules.pop(call_id, (None, ""))
+        if role is None:
+            return  # inner dspy.Predict etc. — only top-level ROMA agents are streamed
+        if exception is not None:
+            self._emit("agent_error", {"role": role, "error": str(exception)})
+            return
+        self._emit("agent_done", {"role": role, "output": str(outputs)[:4000]})
+        if role == "executor":
+            result = getattr(outputs, "result", None)
+            self.subtasks_streamed += 1
+            self._emit("subtask_done", {
+                "id": f"s{next(self._subtask_ids)}",
+                "goal": goal,
+                "result": str(result if result is not None else outputs)[:4000],
+            })
+
+
+def _sse(event: str, data: object) -> bytes:
+    """One SSE frame; data may be a dict or a msgspec Struct (encoded directly, no to_builtins)."""
+    return b"event: " + event.encode() + b"\ndata: " + _json_encoder.encode(data) + b"\n\n"
+
+
+@app.post("/analyze/stream")
+async def analyze_stream(request: Request):
+    """
+    Same solve as /analyze, streamed as Server-Sent Events:
+      task_started → agent_done (per ROMA agent) / subtask_done (per executor, as it
+      finishes) → final_answer → done
+    An `error` event replaces final_answer if the solve fails.
+    """
+    req = await _decode_analyze_request(request)
+    queue: asyncio.Queue = asyncio.Queue()
+    callback = _SolveEventCallback(asyncio.get_running_loop(), queue)
+
+    async def event_gen():
+        yield _sse("task_started", {"goal": req.goal[:200], "roma_mode": req.roma_mode or "keen"})
+        task = asyncio.create_task(run_analyze(req, callbacks=[callback]))
+        try:
+            while not task.done():
+                getter = asyncio.ensure_future(queue.get())
+                done, _ = await asyncio.wait({getter, task}, return_when=asyncio.FIRST_COMPLETED)
+                if getter in done:
+                    yield _sse(*getter.result())
+                else:
+                    getter.cancel()
+            while not queue.empty():
+                yield _sse(*queue.get_nowait())
+
+            try:
+                response = task.result()
+            except HTTPException as e:
+                yield _sse("error", {"status": e.status_code, "detail": e.detail})
+                return
+            if not callback.subtasks_streamed:  # e.g. cache hit — nothing ran live
+                for sub in response.subtasks:
+                    yield _sse("subtask_done", sub)
+            yield _sse("final_answer", response)
+            yield _sse("done", {"duration_ms": response.duration_ms})
+        finally:
+            task.cancel()  # client disconnected — stop waiting on the solve
+
+    return StreamingResponse(event_gen(), media_type="text/event-stream")
 
 
 # ── Calibration & Optimization ────────────────────────────────────────────────
@@ -589,7 +1843,7 @@ def _opt_call_gemini(prompt: str, api_key: str) -> dict:
 def _opt_call_openrouter(prompt: str, api_key: str) -> dict:
     """Call Gemini 2.5 Flash via OpenRouter — used when GOOGLE_AI_API_KEY is absent."""
     import requests as _req
-    model = os.getenv("OPENROUTER_MODEL", "google/gemini-2.5-flash")
+    model = _ENV.openrouter_model
     resp = _req.post(
         "https://openrouter.ai/api/v1/chat/completions",
         headers={"Authorization": f"Bearer {api_key}", "Content-Type": "application/json"},
@@ -636,7 +1890,7 @@ def calibrate(req: CalibrateRequest):
     result = minimize(neg_ll, x0=[1.0, 0.0], method='L-BFGS-B',
                       bounds=[(-10.0, 10.0), (-10.0, 10.0)])
     a, b = result.x.tolist()
-    print(f"[CAL] Platt scaling fitted — a={a:.4f} b={b:.4f} n={len(y)}")
+    log.info("platt_fitted", extra={"a": round(a, 4), "b": round(b, 4), "n": len(y)})
     return CalibrateResponse(a=round(a, 6), b=round(b, 6), n=int(len(y)))
 
 
@@ -700,31 +1954,31 @@ def optimize(req: OptimizeRequest):
     Uses GOOGLE_AI_API_KEY (direct) or falls back to OPENROUTER_API_KEY.
     Receives trade history + calibration data → returns updated DailyOptParams.
     """
-    google_key     = os.getenv('GOOGLE_AI_API_KEY') or os.getenv('GEMINI_API_KEY')
-    openrouter_key = os.getenv('OPENROUTER_API_KEY')
+    google_key     = _ENV.google_ai_api_key
+    openrouter_key = _ENV.openrouter_api_key
     if not google_key and not openrouter_key:
         raise HTTPException(status_code=503, detail="No optimizer API key — set GOOGLE_AI_API_KEY or OPENROUTER_API_KEY")
 
     current_params = dict(_DEFAULT_PARAMS)
     trade_summary  = _opt_summarize_trades(req.trades)
-    print(f"[OPT] Summarized {trade_summary.get('count', 0)} settled trades for optimization")
+    log.info("optimize_trades_summarized", extra={"count": trade_summary.get("count", 0)})
 
     prompt = _opt_build_prompt(trade_summary, req.calibration, current_params)
 
     try:
         if google_key:
             raw = _opt_call_gemini(prompt, google_key)
-            print("[OPT] Used Google AI API (direct)")
+            log.info("optimize_llm", extra={"backend": "google"})
         else:
             raw = _opt_call_openrouter(prompt, openrouter_key)
-            print(f"[OPT] Used OpenRouter ({os.getenv('OPENROUTER_MODEL', 'google/gemini-2.5-flash')})")
+            log.info("optimize_llm", extra={"backend": "openrouter", "model": _ENV.openrouter_model})
     except Exception as e:
         raise HTTPException(status_code=502, detail=f"Optimizer call failed: {str(e)}")
 
     proposed = _opt_apply_bounds(raw)
     final    = _opt_dampen(proposed, current_params)
 
-    print(f"[OPT] Done — risk={raw.get('risk_level')}  brier={trade_summary.get('brier_score', '?')}")
+    log.info("optimize_done", extra={"risk": raw.get("risk_level"), "brier": trade_summary.get("brier_score")})
 
     return OptimizeResponse(
         alphaCap=              final.get('alpha_cap',               _DEFAULT_PARAMS['alpha_cap']),
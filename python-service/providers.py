@@ -0,0 +1,256 @@
+"""
+Provider Failover Pool
+──────────────────────
+Routes a ROMA solve across LLM providers: the requested provider first, then
+the fallbacks in AI_FALLBACK_PROVIDERS (e.g. "openrouter,anthropic") ordered
+by priority × success_rate. Each provider has a simple circuit: it opens after
+a transient failure and half-opens again after PROVIDER_COOLDOWN_S seconds.
+A provider can also have a token-bucket budget of LLM requests (<NAME>_RPM;
+grok and openrouter paced by default) and a daily cap (<NAME>_RPD). Every agent
+call is charged through reserve() and waits its turn instead of failing.
+
+A transient error (429, 5xx, connection reset, timeout) is first retried on the
+same provider with jittered backoff (retry_transient), then moves the solve to
+the next provider, so a provider blip or outage doesn't fail the whole request.
+"""
+
+import os
+import time
+import random
+import logging
+import threading
+from dataclasses import dataclass, field
+from typing import Callable, Optional, TypeVar
+
+logger = logging.getLogger("roma.providers")  # propagates to main's queued JSON handler on "roma"
+
+T = TypeVar("T")
+
+PROVIDERS = ("grok", "openrouter", "anthropic", "openai", "huggingface")
+
+# LLM requests-per-minute pacing (agent calls, not solves); <NAME>_RPM overrides or enables
+# it for any provider, 0 disables. Unlisted providers are unthrottled by default.
+_DEFAULT_RPM = {
+    "grok":       900,     # 15 req/s
+    "openrouter": 3600,    # 60 req/s
+}
+
+_TRANSIENT_ERRORS = {
+    "RateLimitError", "APIConnectionError", "APITimeoutError", "Timeout",
+    "ServiceUnavailableError", "InternalServerError", "ConnectError", "ReadTimeout",
+}
+
+
+def is_transient(exc: BaseException) -> bool:
+    """True for errors worth retrying on another provider (rate limits, 5xx, network)."""
+    if type(exc).__name__ in _TRANSIENT_ERRORS:
+        return True
+    status = getattr(exc, "status_code", None)
+    return isinstance(status, int) and (status == 429 or status >= 500)
+
+
+def retry_transient(
+    fn: Callable[[], T],
+    retries: int = 2,
+    deadline: Optional[float] = None,
+    should_stop: Optional[Callable[[], bool]] = None,
+) -> T:
+    """
+    Call fn(), retrying transient errors up to `retries` times with jittered exponential
+    backoff (0.25s·2ⁿ + U(0, 0.25s), capped at 2s). Gives up early when the next attempt
+    would start after `deadline` (a time.monotonic() value) or should_stop() is True.
+    """
+    for n in range(retries + 1):
+        try:
+            return fn()
+        except Exception as e:
+            if n == retries or not is_transient(e):
+                raise
+            delay = min(0.25 * 2 ** n + random.uniform(0, 0.25), 2.0)
+            if deadline is not None and time.monotonic() + delay >= deadline:
+                raise
+            if should_stop is not None and should_stop():
+                raise
+            logger.warning("transient %s — retry %d/%d in %.2fs", type(e).__name__, n + 1, retries, delay)
+            time.sleep(delay)
+    raise AssertionError("unreachable")
+
+
+class TokenBucket:
+    """Thread-safe token bucket: `rate` tokens/second, bursts up to `capacity`."""
+
+    def __init__(self, rate: float, capacity: float):
+        self.rate     = rate
+        self.capacity = capacity
+        self.tokens   = capacity
+        self.last     = time.monotonic()
+        self._lock    = threading.Lock()
+
+    def _refill(self) -> None:
+        now = time.monotonic()
+        self.tokens = min(self.capacity, self.tokens + (now - self.last) * self.rate)
+        self.last = now
+
+    def reserve(self, n: float = 1.0) -> float:
+        """
+        Take n tokens now, going into debt if short; returns the seconds the caller must
+        wait before using them. The caller picks how to wait (time.sleep / asyncio.sleep),
+        and concurrent callers queue in arrival order.
+        """
+        with self._lock:
+            self._refill()
+            self.tokens -= n
+            return max(0.0, -self.tokens / self.rate)
+
+
+@dataclass
+class ProviderConfig:
+    name: str
+    priority: float = 1.0                 # higher = preferred among fallbacks
+    rpm: Optional[int] = None             # LLM requests per minute; None = unthrottled
+    rpd: Optional[int] = None             # optional daily LLM request cap
+    circuit_state: str = "closed"         # closed | open
+    success_rate: float = 1.0             # EWMA of success (1) / failure (0)
+    ewma_response_time: float = 0.0       # seconds, EWMA over successful solves
+    opened_at: float = 0.0
+    day_count: int = 0
+    day: int = 0
+    bucket: Optional[TokenBucket] = field(init=False, repr=False)
+
+    def __post_init__(self) -> None:
+        self.bucket = (
+            TokenBucket(rate=self.rpm / 60.0, capacity=max(1.0, self.rpm / 60.0 * 5)) if self.rpm else None
+        )
+
+    @property
+    def score(self) -> float:
+        return self.priority * self.success_rate
+
+
+class LLMPool:
+    """Provider ordering, admission and failover for solve() calls."""
+
+    EWMA_ALPHA = 0.2
+
+    def __init__(self, providers: list[ProviderConfig], fallbacks: list[str], cooldown: float = 30.0):
+        self.providers = {p.name: p for p in providers}
+        self.fallbacks = fallbacks
+        self.cooldown  = cooldown
+        self._lock     = threading.Lock()
+
+    @classmethod
+    def from_env(cls) -> "LLMPool":
+        fallbacks = [p.strip() for p in os.getenv("AI_FALLBACK_PROVIDERS", "").split(",") if p.strip()]
+        providers = [
+            ProviderConfig(
+                name=name,
+                priority=float(os.getenv(f"{name.upper()}_PRIORITY", "1.0")),
+                rpm=int(os.environ[f"{name.upper()}_RPM"]) if os.getenv(f"{name.upper()}_RPM")
+                    else _DEFAULT_RPM.get(name),
+                rpd=int(os.environ[f"{name.upper()}_RPD"]) if os.getenv(f"{name.upper()}_RPD") else None,
+            )
+            for name in PROVIDERS
+        ]
+        return cls(providers, fallbacks, cooldown=float(os.getenv("PROVIDER_COOLDOWN_S", "30")))
+
+    def _provider(self, name: str) -> ProviderConfig:
+        with self._lock:
+            if name not in self.providers:
+                self.providers[name] = ProviderConfig(name=name)
+            return self.providers[name]
+
+    def _available(self, p: ProviderConfig) -> bool:
+        if p.circuit_state == "open" and time.monotonic() - p.opened_at < self.cooldown:
+            return False
+        today = int(time.time() // 86400)
+        if p.day != today:
+            p.day, p.day_count = today, 0
+        return p.rpd is None or p.day_count < p.rpd
+
+    def reserve(self, name: str) -> float:
+        """Charge one LLM request to a provider's budget; returns seconds to wait before sending it."""
+        p = self._provider(name)
+        with self._lock:
+            today = int(time.time() // 86400)
+            if p.day != today:
+                p.day, p.day_count = today, 0
+            p.day_count += 1
+        return p.bucket.reserve() if p.bucket is not None else 0.0
+
+    def candidates(self, primary: str, configured: Optional[Callable[[str], bool]] = None) -> list[str]:
+        """
+        Primary first (unless its circuit is open), then fallbacks by priority × success_rate.
+        configured(name) False drops a fallback up front (e.g. no API key for it).
+        """
+        fallbacks = sorted(
+            (self._provider(n) for n in self.fallbacks
+             if n != primary and (configured is None or configured(n))),
+            key=lambda p: p.score,
+            reverse=True,
+        )
+        ordered = [self._provider(primary)] + fallbacks
+        usable = [p.name for p in ordered if self._available(p)]
+        return usable or [primary]  # everything tripped — still try the caller's choice
+
+    def record_success(self, name: str, elapsed: float) -> None:
+        p = self._provider(name)
+        with self._lock:
+            p.success_rate = (1 - self.EWMA_ALPHA) * p.success_rate + self.EWMA_ALPHA
+            p.ewma_response_time = (
+                elapsed if p.ewma_response_time == 0.0
+                else (1 - self.EWMA_ALPHA) * p.ewma_response_time + self.EWMA_ALPHA * elapsed
+            )
+            p.circuit_state = "closed"
+
+    def record_failure(self, name: str) -> None:
+        p = self._provider(name)
+        with self._lock:
+            p.success_rate = (1 - self.EWMA_ALPHA) * p.success_rate
+            p.circuit_state = "open"
+            p.opened_at = time.monotonic()
+
+    def run(
+        self,
+        primary: str,
+        fn: Callable[[str], T],
+        on_failover: Optional[Callable[[str], None]] = None,
+        should_stop: Optional[Callable[[], bool]] = None,
+        configured: Optional[Callable[[str], bool]] = None,
+    ) -> T:
+        """
+        Call fn(provider) on the first provider that succeeds. Non-transient errors
+        from the primary are raised immediately; fallbacks are best-effort.
+        on_failover(failed_provider) runs only when another candidate is about to be tried
+        — never after the last attempt or when should_stop() ends the chain.
+        should_stop() is checked before each attempt — True abandons the failover chain
+        (the caller has already given up on the result). Request budgets are charged
+        per LLM call via reserve(), not here. Only transient errors open a provider's
+        circuit — a config error or cancellation says nothing about the provider's health.
+        """
+        first_error: Optional[BaseException] = None
+        failed: Optional[str] = None
+        for attempt, name in enumerate(self.candidates(primary, configured)):
+            if should_stop is not None and should_stop():
+                break
+            if failed is not None and on_failover is not None:
+                on_failover(failed)
+            if attempt > 0:
+                time.sleep(min(0.5 * 2 ** (attempt - 1), 4.0))
+            t0 = time.monotonic()
+            try:
+                result = fn(name)
+            except Exception as e:
+                if name == primary and not is_transient(e):
+                    raise
+                first_error = first_error or e
+                if is_transient(e):
+                    self.record_failure(name)
+                logger.warning("provider %s failed (%s) — failing over", name, type(e).__name__)
+                failed = name
+                continue
+            self.record_success(name, time.monotonic() - t0)
+            return result
+
+        if first_error is not None:
+            raise first_error
+        raise RuntimeError(f"No provider available for solve (primary={primary})")
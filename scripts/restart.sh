@@ -11,7 +11,7 @@ sleep 1
 echo "→ Starting Python ROMA service..."
 cd "$PROJECT_DIR/python-service"
 source .venv/bin/activate
-python3 -m uvicorn main:app --port 8001 --host 0.0.0.0 &
+python3 -m uvicorn main:app --port 8001 --host 0.0.0.0 --loop uvloop --http httptools &
 UVICORN_PID=$!
 
 echo "→ Starting Next.js dev server..."